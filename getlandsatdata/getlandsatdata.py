@@ -1,36 +1,255 @@
-#!/usr/bin/env python2
+#!/usr/bin/env python
 # -*- coding: utf-8 -*-
 """
 Created on Thu Oct 19 08:51:51 2017
 
 @author: mschull
 """
+from time import sleep, time
+# start of the module import, the origin of the --timing startup measurement
+_IMPORT_START = time()
 import os
-import numpy as np
-import glob
 import shutil
-import pandas as pd
+import importlib
 from datetime import datetime
 from datetime import date as dt
-import wget
 import argparse
 import getpass
-import keyring
 import json
 import sqlite3
-import pycurl
-import requests
-from time import sleep
 import logging
 import tarfile
 import gzip
 import zipfile
+import hashlib
+import errno
+import fnmatch
+import re
+import sys
+import threading
+import multiprocessing
+import tempfile
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, Future, as_completed, wait, FIRST_COMPLETED
+from collections import deque, OrderedDict
+from contextlib import contextmanager
+from queue import Queue
+from urllib.parse import urlparse, parse_qs, urlencode
+from urllib.request import urlopen
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+class _LazyModule(object):
+    """
+    Stands in for a module that is only imported on first attribute access, so the
+    heavy (pandas, numpy) and network (requests, keyring) imports stay off the startup
+    path of the commands that never use them, e.g. a local search.
+    """
+
+    def __init__(self, name):
+        self.__dict__['_name'] = name
+        self.__dict__['_module'] = None
+
+    def __getattr__(self, attr):
+        module = self.__dict__['_module']
+        if module is None:
+            module = importlib.import_module(self.__dict__['_name'])
+            self.__dict__['_module'] = module
+        return getattr(module, attr)
+
+
+np = _LazyModule('numpy')
+pd = _LazyModule('pandas')
+keyring = _LazyModule('keyring')
+requests = _LazyModule('requests')
+asyncio = _LazyModule('asyncio')
 
 logging.getLogger("urllib3").setLevel(logging.WARNING)
 logging.getLogger("urllib3").setLevel(logging.DEBUG)
 
 host = 'https://espa.cr.usgs.gov/api/v1/'
 TIMEOUT = 86400
+# attempts, initial backoff in seconds and block size in bytes of product downloads
+DOWNLOAD_RETRIES = 5
+DOWNLOAD_BACKOFF = 2
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+# ESPA item statuses that will not change anymore
+ORDER_FINAL_STATUSES = ('complete', 'error', 'unavailable', 'purged', 'cancelled')
+# seconds to wait before checking an order again, by the status of its pending items
+ORDER_POLL_INTERVALS = {'processing': 60, 'queued': 180, 'oncache': 300, 'retry': 300,
+                        'submitted': 600, 'onorder': 900}
+# seconds the cached status of an in-flight ESPA order stays valid
+ORDER_CACHE_TTL = 300
+# name of the local ESPA order cache database in the cache directory
+ORDER_CACHE_DB = 'espa_orders.db'
+# maximum number of scenes per ESPA order
+ORDER_BATCH_SIZE = 50
+# seconds before a scene claimed by another run, but not ordered, is claimed again
+ORDER_CLAIM_TIMEOUT = 3600
+# seconds between checks for scenes another run is ordering
+ORDER_CLAIM_POLL = 10
+metadata_host = 'https://landsat.usgs.gov/landsat/metadata_service/bulk_metadata_files/'
+# minimum number of seconds between two conditional checks of a bulk metadata file
+METADATA_REFRESH_INTERVAL = 3600
+# byte quota of the local product cache, e.g. '500G', unlimited when not set
+CACHE_QUOTA = os.environ.get('GETLANDSATDATA_CACHE_QUOTA')
+# seconds before the access time of a cached product is recorded again
+TOUCH_INTERVAL = 600
+# bytes reserved per product to download when nothing is cached yet to estimate from
+PRODUCT_BYTES_ESTIMATE = 1 << 30
+# start method of the extraction processes, forking while the download and poll threads
+# run can deadlock the child on a lock one of those threads held
+EXTRACT_START_METHOD = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+
+# seconds a catalog writer waits for the write lock before giving up
+SQLITE_BUSY_TIMEOUT = 120
+# WAL needs shared memory that network filesystems do not reliably provide, set
+# GETLANDSATDATA_JOURNAL_MODE=DELETE when SATELLITE_DATA is on NFS, Lustre, ...
+CATALOG_JOURNAL_MODE = os.environ.get('GETLANDSATDATA_JOURNAL_MODE', 'WAL').upper()
+# discovery file a running catalog service writes to the cache directory
+SERVICE_FILE = 'catalog_service.json'
+# number of query results the catalog service keeps
+SERVICE_CACHE_SIZE = 1024
+# seconds the CLI waits for the catalog service before falling back to a direct search
+SERVICE_TIMEOUT = 30
+# LANDSAT_PRODUCT_ID at the start of a product file name,
+# e.g. LC08_L1TP_044034_20170710_20170725_01_T1_sr_band1.tif
+PRODUCT_ID_PATTERN = re.compile(r'^(L[COTEM]0[1-8]_[A-Z0-9]{4}_\d{6}_\d{8}_\d{8}_\d{2}_[A-Z0-9]{2})')
+# file name prefix of the products of each satellite
+PRODUCT_PREFIXES = {7: 'LE07', 8: 'LC08'}
+# columns kept from the bulk metadata CSV in the raw_data catalog table
+CATALOG_COLUMNS = ['sceneID', 'sensor', 'acquisitionDate', 'dateUpdated', 'upperLeftCornerLatitude',
+                   'upperLeftCornerLongitude', 'lowerRightCornerLatitude', 'lowerRightCornerLongitude', 'cloudCover',
+                   'LANDSAT_PRODUCT_ID']
+CATALOG_DTYPES = {'sceneID': str, 'sensor': str, 'acquisitionDate': str, 'dateUpdated': str,
+                  'upperLeftCornerLatitude': 'float64', 'upperLeftCornerLongitude': 'float64',
+                  'lowerRightCornerLatitude': 'float64', 'lowerRightCornerLongitude': 'float64',
+                  'cloudCover': 'float64', 'LANDSAT_PRODUCT_ID': str}
+# rows of the bulk metadata CSV read and inserted per batch when building the catalog
+CATALOG_CHUNKSIZE = 100000
+RAW_DATA_SCHEMA = ("CREATE TABLE raw_data (sceneID TEXT, sensor TEXT, acquisitionDate TEXT, dateUpdated TEXT, "
+                   "upperLeftCornerLatitude REAL, upperLeftCornerLongitude REAL, "
+                   "lowerRightCornerLatitude REAL, lowerRightCornerLongitude REAL, "
+                   "cloudCover REAL, LANDSAT_PRODUCT_ID TEXT, sr TEXT DEFAULT 'N', "
+                   "bt TEXT DEFAULT 'N', local_file_path TEXT DEFAULT '', "
+                   "cache_bytes INTEGER DEFAULT 0, last_access REAL)")
+# R*Tree rows (rowid, minLat, maxLat, minLon, maxLon) for the scenes in raw_data, MIN/MAX keep
+# the box valid for scenes crossing the antimeridian, the exact corner test in search() weeds
+# out the false positives
+RAW_DATA_RTREE_ROWS = ("SELECT rowid, "
+                       "MIN(lowerRightCornerLatitude, upperLeftCornerLatitude), "
+                       "MAX(lowerRightCornerLatitude, upperLeftCornerLatitude), "
+                       "MIN(upperLeftCornerLongitude, lowerRightCornerLongitude), "
+                       "MAX(upperLeftCornerLongitude, lowerRightCornerLongitude) "
+                       "FROM raw_data WHERE upperLeftCornerLatitude IS NOT NULL "
+                       "AND upperLeftCornerLongitude IS NOT NULL "
+                       "AND lowerRightCornerLatitude IS NOT NULL "
+                       "AND lowerRightCornerLongitude IS NOT NULL")
+
+
+class EspaClient(object):
+    """
+    Client for the ESPA JSON REST API. All calls share one keep-alive session, so the
+    TCP/TLS handshake is paid once per connection rather than once per call. Idempotent
+    calls are retried with exponential backoff on 429 and 5xx responses, calls can be
+    spaced by a minimum interval to stay under a rate limit, and the latency of each
+    endpoint is recorded.
+    """
+
+    def __init__(self, auth, retries=3, backoff=1.0, min_interval=0.0, pool_size=8):
+        """
+        :param auth:            tuple(usgs username, usgs password)
+        :param retries:         number of retries on 429/5xx responses and connection errors
+        :param backoff:         backoff factor in seconds between retries
+        :param min_interval:    minimum number of seconds between the start of two calls
+        :param pool_size:       number of keep-alive connections kept to the API host
+        """
+        self.auth = auth
+        self.min_interval = min_interval
+        from urllib3.util.retry import Retry
+        self.session = requests.Session()
+        retry = Retry(total=retries, backoff_factor=backoff, status_forcelist=(429, 500, 502, 503, 504),
+                      raise_on_status=False)
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.latency = {}
+        self._lock = threading.Lock()
+        self._last_call = 0.0
+
+    def _throttle(self):
+        if self.min_interval <= 0:
+            return
+        with self._lock:
+            wait = self._last_call + self.min_interval - time()
+            self._last_call = max(time(), self._last_call + self.min_interval)
+        if wait > 0:
+            sleep(wait)
+
+    def _record(self, endpoint, elapsed):
+        name = endpoint.split('/')[0]
+        with self._lock:
+            calls, total = self.latency.get(name, (0, 0.0))
+            self.latency[name] = (calls + 1, total + elapsed)
+
+    def request(self, endpoint, verb='get', body=None):
+        """
+        Calls an API endpoint, prints the messages the API returns and returns the decoded
+        JSON response, or None if the call failed.
+
+        :param endpoint:    endpoint path relative to the API host, e.g. 'item-status/<orderid>'
+        :param verb:        HTTP verb, 'get' or 'post'
+        :param body:        optional JSON body
+        """
+        self._throttle()
+        starttime = time()
+        try:
+            response = self.session.request(verb.upper(), host + endpoint, auth=self.auth, json=body)
+        except requests.RequestException as e:
+            # connection errors and 5xx responses left once the retries are exhausted
+            self._record(endpoint, time() - starttime)
+            print(e)
+            return None
+        self._record(endpoint, time() - starttime)
+        print('{} {}'.format(response.status_code, response.reason))
+        try:
+            data = response.json()
+        except ValueError:
+            # e.g. the HTML error page of a gateway
+            print("Could not decode the response to {0}".format(endpoint))
+            return None
+        if isinstance(data, dict):
+            messages = data.pop("messages", None)
+            if messages:
+                print(json.dumps(messages, indent=4))
+        try:
+            response.raise_for_status()
+        except Exception as e:
+            print(e)
+            return None
+        else:
+            return data
+
+    def report(self):
+        """ prints the number of calls and the mean latency of each endpoint """
+        for name, (calls, total) in sorted(self.latency.items()):
+            print("{0}: {1} calls, {2:.0f} ms mean".format(name, calls, 1000.0 * total / calls))
+
+
+_espa_clients = {}
+_espa_clients_lock = threading.Lock()
+
+
+def get_espa_client(auth):
+    """ returns the shared EspaClient for a set of USGS credentials """
+    auth = tuple(auth)
+    with _espa_clients_lock:
+        if auth not in _espa_clients:
+            _espa_clients[auth] = EspaClient(auth)
+        return _espa_clients[auth]
 
 
 def espa_api(endpoint, verb='get', body=None, uauth=None):
@@ -42,23 +261,55 @@ def espa_api(endpoint, verb='get', body=None, uauth=None):
         print("need USGS creds!")
         exit()
 
-    response = getattr(requests, verb)(host + endpoint, auth=auth_tup, json=body)
-    print('{} {}'.format(response.status_code, response.reason))
-    data = response.json()
-    if isinstance(data, dict):
-        messages = data.pop("messages", None)
-        if messages:
-            print(json.dumps(messages, indent=4))
-    try:
-        response.raise_for_status()
-    except Exception as e:
-        print(e)
-        return None
-    else:
-        return data
+    return get_espa_client(auth_tup).request(endpoint, verb=verb, body=body)
+
 
+def _member_selected(name, include=None, exclude=None):
+    """
+    Tells whether an archive member should be extracted, matching the patterns
+    against the member's file name.
 
-def extract_archive(source_path, destination_path=None, delete_originals=False):
+    :param name:        member name inside the archive
+    :param include:     optional list of glob patterns, e.g. ['*_sr_band[2-5].tif', '*MTL.txt'],
+                        only matching members are kept
+    :param exclude:     optional list of glob patterns of members to skip
+    """
+    basename = os.path.basename(name)
+    if include and not any(fnmatch.fnmatch(basename, pattern) for pattern in include):
+        return False
+    if exclude and any(fnmatch.fnmatch(basename, pattern) for pattern in exclude):
+        return False
+    return True
+
+
+def _extract_tar_members(tfile, path, include=None, exclude=None):
+    """ extracts the selected members of an open tarfile, also works in stream mode """
+    if not os.path.isdir(path):
+        os.makedirs(path)
+    if not include and not exclude:
+        tfile.extractall(path)
+        return
+    for member in tfile:
+        if member.isfile() and _member_selected(member.name, include, exclude):
+            tfile.extract(member, path)
+
+
+def _clear_path(path):
+    """ removes a file or folder if it exists """
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    elif os.path.exists(path):
+        os.remove(path)
+
+
+def _replace_path(part, dest):
+    """ moves a finished extraction in place of dest, replacing any earlier one """
+    if os.path.isdir(dest):
+        shutil.rmtree(dest)
+    os.replace(part, dest)
+
+
+def extract_archive(source_path, destination_path=None, delete_originals=False, include=None, exclude=None):
     """
     Attempts to decompress the following formats for input filepath
     Support formats include `.tar.gz`, `.tar`, `.gz`, `.zip`.
@@ -66,6 +317,9 @@ def extract_archive(source_path, destination_path=None, delete_originals=False):
     :param destination_path:    path to unzip, will be same name with dropped extension if left None
     :param delete_originals:    Set to "True" if archives may be deleted after
                                 their contents is successful extracted.
+    :param include:             optional list of glob patterns, only archive members whose
+                                file name matches one of them are extracted
+    :param exclude:             optional list of glob patterns of archive members to skip
     """
 
     head, tail = os.path.split(source_path)
@@ -76,32 +330,45 @@ def extract_archive(source_path, destination_path=None, delete_originals=False):
         else:
             return os.path.join(head, tail.replace(file_ext, ""))
 
+    # members are unpacked next to the destination and swapped in once complete, so a
+    # re-extraction with other include/exclude patterns leaves no stale members behind
     if source_path.endswith(".tar.gz"):
+        dest = set_destpath(destination_path, ".tar.gz")
+        _clear_path(dest + '.part')
         with tarfile.open(source_path, 'r:gz') as tfile:
-            tfile.extractall(set_destpath(destination_path, ".tar.gz"))
+            _extract_tar_members(tfile, dest + '.part', include, exclude)
             ret = destination_path
 
     # gzip only compresses single files
     elif source_path.endswith(".gz"):
+        dest = set_destpath(destination_path, ".gz")
+        _clear_path(dest + '.part')
         with gzip.open(source_path, 'rb') as gzfile:
-            content = gzfile.read()
-            with open(set_destpath(destination_path, ".gz"), 'wb') as of:
-                of.write(content)
+            with open(dest + '.part', 'wb') as of:
+                shutil.copyfileobj(gzfile, of, DOWNLOAD_CHUNK_SIZE)
             ret = destination_path
 
     elif source_path.endswith(".tar"):
+        dest = set_destpath(destination_path, ".tar")
+        _clear_path(dest + '.part')
         with tarfile.open(source_path, 'r') as tfile:
-            tfile.extractall(set_destpath(destination_path, ".tar"))
+            _extract_tar_members(tfile, dest + '.part', include, exclude)
             ret = destination_path
 
     elif source_path.endswith(".zip"):
+        dest = set_destpath(destination_path, ".zip")
+        _clear_path(dest + '.part')
         with zipfile.ZipFile(source_path, "r") as zipf:
-            zipf.extractall(set_destpath(destination_path, ".zip"))
+            members = [name for name in zipf.namelist()
+                       if not name.endswith('/') and _member_selected(name, include, exclude)]
+            os.makedirs(dest + '.part')
+            zipf.extractall(dest + '.part', members=members)
             ret = destination_path
 
     else:
         raise Exception("supported types are tar.gz, gz, tar, zip")
 
+    _replace_path(dest + '.part', dest)
     print("Extracted {0}".format(source_path))
     if delete_originals:
         os.remove(source_path)
@@ -109,30 +376,200 @@ def extract_archive(source_path, destination_path=None, delete_originals=False):
     return ret
 
 
+def _raise_download_errors(errors, total):
+    """
+    Reports every failed download of a batch and raises once for all of them, after the
+    other downloads of the batch have finished.
+
+    :param errors:  list of tuple(source url, exception)
+    :param total:   number of downloads in the batch
+    """
+    if not errors:
+        return
+    for source, e in errors:
+        print("Could not download {0}: {1}".format(source, e))
+    raise Exception("{0} of {1} downloads failed".format(len(errors), total)) from errors[0][1]
+
+
+class _HashingReader(object):
+    """ file-like wrapper that md5-hashes and counts the bytes read through it """
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.md5 = hashlib.md5()
+        self.nbytes = 0
+
+    def read(self, size=-1):
+        block = self.fileobj.read(size)
+        self.md5.update(block)
+        self.nbytes += len(block)
+        return block
+
+
 class BaseDownloader(object):
     """ basic downloader class with general/universal download utils """
 
-    def __init__(self, local_dir):
+    def __init__(self, local_dir, max_workers=8, per_host=4, extract_workers=None):
+        """
+        :param local_dir:       directory to download and extract into
+        :param max_workers:     size of the worker pool used by download_queue()
+        :param per_host:        maximum number of concurrent downloads from a single host
+        :param extract_workers: size of the extraction process pool used by pipeline_queue(),
+                                defaults to the number of cores
+        """
         self.local_dir = local_dir
         self.queue = []
+        self.max_workers = max_workers
+        self.per_host = per_host
+        self.extract_workers = extract_workers or os.cpu_count() or 1
+        self.pipeline_stats = {}
+        self._host_slots = {}
+        self._host_lock = threading.Lock()
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
 
         if not os.path.exists(local_dir):
             os.mkdir(local_dir)
 
-    @staticmethod
-    def _download(source, dest, retries=2):
-        trynum = 0
-        while trynum < retries:
+    def _fetch(self, source, part):
+        """
+        Streams source into the .part file, resuming from its current size with an HTTP
+        Range request. Raises IOError if the transfer ends short of the expected size.
+        """
+        offset = os.path.getsize(part) if os.path.exists(part) else 0
+        # identity encoding keeps byte offsets meaningful for Range requests
+        headers = {'Accept-Encoding': 'identity'}
+        if offset:
+            headers['Range'] = 'bytes={0}-'.format(offset)
+        response = self.session.get(source, headers=headers, stream=True, timeout=60)
+        try:
+            if offset and response.status_code == 416:
+                # the range starts at or past the end, the .part file may already be whole
+                total = response.headers.get('Content-Range', '').split('/')[-1]
+                if total.isdigit() and int(total) == offset:
+                    return
+                os.remove(part)
+                raise IOError("{0} is larger than {1}".format(part, source))
+            response.raise_for_status()
+            if response.status_code == 206:
+                total = int(response.headers['Content-Range'].split('/')[-1])
+                filemode = 'ab'
+            else:
+                # the server ignored the Range header, start over
+                length = response.headers.get('Content-Length')
+                total = int(length) if length is not None else None
+                filemode = 'wb'
+            with open(part, filemode) as of:
+                for block in response.iter_content(DOWNLOAD_CHUNK_SIZE):
+                    of.write(block)
+        finally:
+            response.close()
+        size = os.path.getsize(part)
+        if total is not None and size != total:
+            raise IOError("Incomplete download of {0}: {1} of {2} bytes".format(source, size, total))
+
+    def _stream_extract(self, source, ext_dest, retries=DOWNLOAD_RETRIES, checksum=None, include=None,
+                        exclude=None):
+        """
+        Pipes the response body of source straight into the decompressor, writing archive
+        members as they arrive, so the archive itself never touches the disk. Members are
+        unpacked into ext_dest + '.part' and the folder is only renamed to ext_dest once the
+        whole archive, and its md5 checksum if given, checked out. A failed attempt starts
+        over after an exponential backoff, there is nothing to resume from.
+
+        :param source:      url of a .tar.gz, .tar or .gz file
+        :param ext_dest:    extraction destination
+        :param retries:     number of attempts before giving up
+        :param checksum:    optional md5 hex digest of the archive
+        :param include:     optional glob patterns of the tar members to extract
+        :param exclude:     optional glob patterns of the tar members to skip
+        :return: ext_dest
+        """
+        part = ext_dest + '.part'
+        for trynum in range(retries):
+            _clear_path(part)
+            try:
+                response = self.session.get(source, headers={'Accept-Encoding': 'identity'}, stream=True,
+                                            timeout=60)
+                try:
+                    response.raise_for_status()
+                    reader = _HashingReader(response.raw)
+                    path = urlparse(source).path
+                    if path.endswith(".tar.gz") or path.endswith(".tar"):
+                        with tarfile.open(fileobj=reader, mode='r|gz' if path.endswith(".gz") else 'r|') as tfile:
+                            _extract_tar_members(tfile, part, include, exclude)
+                    elif path.endswith(".gz"):
+                        with gzip.GzipFile(fileobj=reader, mode='rb') as gzfile:
+                            with open(part, 'wb') as of:
+                                shutil.copyfileobj(gzfile, of, DOWNLOAD_CHUNK_SIZE)
+                    else:
+                        raise Exception("supported stream types are tar.gz, tar, gz")
+                    # drain the padding tarfile leaves unread so the checksum covers the whole file
+                    while reader.read(DOWNLOAD_CHUNK_SIZE):
+                        pass
+                finally:
+                    response.close()
+                if checksum is not None and reader.md5.hexdigest() != checksum.lower():
+                    raise IOError("Checksum mismatch for {0}".format(source))
+                break
+            except (requests.RequestException, IOError, EOFError, tarfile.TarError) as e:
+                wait = DOWNLOAD_BACKOFF * 2 ** trynum
+                print("Streaming {0} failed ({1}), retrying in {2}s".format(source, e, wait))
+                sleep(wait)
+        else:
+            raise IOError("Could not download {0} after {1} attempts".format(source, retries))
+
+        _replace_path(part, ext_dest)
+        print("Extracted {0}".format(source))
+        return ext_dest
+
+    def _checksum(self, checksum_url):
+        """ returns the md5 hex digest listed in an ESPA checksum file """
+        response = self.session.get(checksum_url, timeout=60)
+        response.raise_for_status()
+        return response.text.split()[0].lower()
+
+    def _download(self, source, dest, retries=DOWNLOAD_RETRIES, checksum=None):
+        """
+        Downloads source to dest through a dest + '.part' file. A failed transfer is
+        resumed after an exponential backoff, and the file is only moved to dest once its
+        size, and md5 checksum if one is given, are verified.
+
+        :param source:      url from which to download data
+        :param dest:        local file path
+        :param retries:     number of attempts before giving up
+        :param checksum:    optional md5 hex digest of the file
+        :return: dest
+        """
+        part = dest + '.part'
+        for trynum in range(retries):
             try:
-                wget.download(url=source, out=dest)
-                return dest
-            except:
-                sleep(1)
+                self._fetch(source, part)
+                break
+            except (requests.RequestException, IOError) as e:
+                wait = DOWNLOAD_BACKOFF * 2 ** trynum
+                print("Download of {0} failed ({1}), retrying in {2}s".format(source, e, wait))
+                sleep(wait)
+        else:
+            raise IOError("Could not download {0} after {1} attempts".format(source, retries))
+
+        if checksum is not None:
+            md5 = hashlib.md5()
+            with open(part, 'rb') as f:
+                for block in iter(lambda: f.read(DOWNLOAD_CHUNK_SIZE), b''):
+                    md5.update(block)
+            if md5.hexdigest() != checksum.lower():
+                os.remove(part)
+                raise IOError("Checksum mismatch for {0}".format(source))
+        os.replace(part, dest)
+        return dest
 
     @staticmethod
-    def _extract(source, dest):
+    def _extract(source, dest, include=None, exclude=None):
         """ extracts a file to destination"""
-        return extract_archive(source, dest, delete_originals=False)
+        return extract_archive(source, dest, delete_originals=False, include=include, exclude=exclude)
 
     def _raw_destination_mapper(self, source):
         """ returns raw download destination from source url"""
@@ -142,25 +579,38 @@ class BaseDownloader(object):
     def _ext_destination_mapper(self, source):
         """ maps a raw destination into an extracted directory dest """
         filename = os.path.basename(source).replace(".tar.gz", "")
-        tilename = filename
+        # single gzipped files extract next to the download, not on top of it
+        tilename = filename[:-3] if filename.endswith(".gz") else filename
         return os.path.join(self.local_dir, tilename)
 
-    def download(self, source, mode='w', cleanup=True):
+    def download(self, source, mode='w', cleanup=True, checksum_url=None, stream=False, include=None,
+                 exclude=None):
         """
         Downloads the source url and extracts it to a folder. Returns
         a tuple with the extract destination, and a bool to indicate if it is a
         fresh download or if it was already found at that location.
 
-        :param source:  url from which to download data
-        :param mode:    either 'w' or 'w+' to write or overwrite
-        :param cleanup: use True to delete intermediate files (the tar.gz's)
+        :param source:          url from which to download data
+        :param mode:            either 'w' or 'w+' to write or overwrite
+        :param cleanup:         use True to delete intermediate files (the tar.gz's)
+        :param checksum_url:    optional url of an md5 checksum file to verify the download
+        :param stream:          use True to extract while downloading, without staging the
+                                archive on disk. Interrupted transfers are not resumed.
+        :param include:         optional list of glob patterns, only archive members whose file
+                                name matches one of them are extracted, e.g.
+                                ['*_sr_band[2-5].tif', '*_bt_band10.tif', '*MTL.txt']
+        :param exclude:         optional list of glob patterns of archive members to skip
         :return: tuple(destination path (str), new_download? (bool))
         """
         raw_dest = self._raw_destination_mapper(source)
         ext_dest = self._ext_destination_mapper(raw_dest)
         if not os.path.exists(ext_dest) or mode == 'w+':
-            self._download(source, raw_dest)
-            self._extract(raw_dest, ext_dest)
+            checksum = self._checksum(checksum_url) if checksum_url else None
+            if stream:
+                self._stream_extract(source, ext_dest, checksum=checksum, include=include, exclude=exclude)
+            else:
+                self._download(source, raw_dest, checksum=checksum)
+                self._extract(raw_dest, ext_dest, include=include, exclude=exclude)
             fresh = True
         else:
             print("Found: {0}, Use mode='w+' to force rewrite".format(ext_dest))
@@ -169,228 +619,1475 @@ class BaseDownloader(object):
             os.remove(raw_dest)
         return ext_dest, fresh
 
+    def _host_slot(self, source):
+        """ returns the semaphore bounding concurrent downloads from the source's host """
+        netloc = urlparse(source).netloc
+        with self._host_lock:
+            if netloc not in self._host_slots:
+                self._host_slots[netloc] = threading.BoundedSemaphore(self.per_host)
+            return self._host_slots[netloc]
 
-def check_order_cache(auth):
-    # This program checks the last month of orders from ESPA
-    username = auth[0]
-    password = auth[1]
+    def extract_pool(self):
+        """ returns a new process pool of extract_workers for extract_archive() """
+        return ProcessPoolExecutor(max_workers=self.extract_workers,
+                                   mp_context=multiprocessing.get_context(EXTRACT_START_METHOD))
 
-    def api_request(endpoint, verb='get', json=None, uauth=None):
+    def _pooled_download(self, source, dlkwargs):
+        with self._host_slot(source):
+            return self.download(source, **dlkwargs)
+
+    def enqueue(self, source, **dlkwargs):
         """
-        Here we can see how easy it is to handle calls to a REST API that uses JSON
+        Adds a url to the download queue, it is fetched by the next download_queue() call.
+
+        :param source:      url from which to download data
+        :param dlkwargs:    keyword arguments for the download() method
         """
-        auth_tup = uauth if uauth else (username, password)
-        response = getattr(requests, verb)(host + endpoint, auth=auth_tup, json=json)
-        return response.json()
+        self.queue.append((source, dlkwargs))
 
-    def espa_api(endpoint, verb='get', body=None, uauth=None):
-        """ Suggested simple way to interact with the ESPA JSON REST API """
-        auth_tup = uauth if uauth else (username, password)
-        response = getattr(requests, verb)(host + endpoint, auth=auth_tup, json=body)
-        print('{} {}'.format(response.status_code, response.reason))
-        data = response.json()
-        if isinstance(data, dict):
-            messages = data.pop("messages", None)
-            if messages:
-                print(json.dumps(messages, indent=4))
-        try:
-            response.raise_for_status()
-        except Exception as e:
-            print(e)
+    def download_queue(self):
+        """
+        Downloads every queued url with a pool of max_workers threads, running at most
+        per_host downloads against any one host, and yields the download() results as
+        each one completes, in completion order. A failed download does not stop the
+        others, the failures are raised together once the rest are done.
+
+        :return: yields tuple(destination path (str), new_download? (bool))
+        """
+        queue, self.queue = self.queue, []
+        if not queue:
+            return
+        errors = []
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            futures = dict((pool.submit(self._pooled_download, source, dlkwargs), source)
+                           for source, dlkwargs in queue)
+            for future in as_completed(futures):
+                try:
+                    result = future.result()
+                except Exception as e:
+                    errors.append((futures[future], e))
+                    continue
+                yield result
+        _raise_download_errors(errors, len(queue))
+
+    def _pipeline_fetch(self, source, mode='w', cleanup=True, checksum_url=None):
+        """
+        First stage of pipeline_queue(): downloads the archive, returns its local path or
+        None if the extracted folder already exists.
+        """
+        raw_dest = self._raw_destination_mapper(source)
+        ext_dest = self._ext_destination_mapper(raw_dest)
+        if os.path.exists(ext_dest) and mode != 'w+':
+            print("Found: {0}, Use mode='w+' to force rewrite".format(ext_dest))
             return None
-        else:
-            return data
+        with self._host_slot(source):
+            checksum = self._checksum(checksum_url) if checksum_url else None
+            return self._download(source, raw_dest, checksum=checksum)
+
+    def pipeline_queue(self):
+        """
+        Runs the queued urls through a two-stage pipeline: downloads in a thread pool of
+        max_workers and archive extraction in a process pool of extract_workers, so the
+        network stays busy while archives are decompressed. At most twice extract_workers
+        downloaded archives wait for extraction at any time. Results are yielded as soon as
+        an item clears both stages. Failed items are raised together at the end. Items
+        queued with stream=True have no archive to hand over, they are downloaded and
+        extracted in one go in the download pool.
+
+        The time each stage spent waiting on the other is kept in self.pipeline_stats:
+        'extract_wait' is the time the extraction pool sat empty waiting for downloads,
+        'fetch_wait' the time new downloads were held back by the extraction backlog.
+
+        :return: yields tuple(destination path (str), new_download? (bool))
+        """
+        queue, self.queue = deque(self.queue), []
+        total = len(queue)
+        errors = []
+        backlog = 2 * self.extract_workers
+        stats = self.pipeline_stats = {'fetched': 0, 'extracted': 0, 'fetch_wait': 0.0, 'extract_wait': 0.0}
+        fetching = {}
+        extracting = {}
+        with ThreadPoolExecutor(max_workers=self.max_workers) as fetch_pool, \
+                self.extract_pool() as extract_pool:
+            while queue or fetching or extracting:
+                while queue and len(fetching) < self.max_workers and len(fetching) + len(extracting) < backlog:
+                    source, dlkwargs = queue.popleft()
+                    dlkwargs = dict(dlkwargs)
+                    ext_dest = self._ext_destination_mapper(self._raw_destination_mapper(source))
+                    if dlkwargs.get('stream'):
+                        future = fetch_pool.submit(self._pooled_download, source, dlkwargs)
+                        fetching[future] = (source, ext_dest, None)
+                        continue
+                    dlkwargs.pop('stream', None)
+                    extkwargs = {'delete_originals': dlkwargs.get('cleanup', True),
+                                 'include': dlkwargs.pop('include', None),
+                                 'exclude': dlkwargs.pop('exclude', None)}
+                    future = fetch_pool.submit(self._pipeline_fetch, source, **dlkwargs)
+                    fetching[future] = (source, ext_dest, extkwargs)
+                held_back = bool(queue) and len(fetching) < self.max_workers
+
+                waitstart = time()
+                done, _ = wait(list(fetching) + list(extracting), return_when=FIRST_COMPLETED)
+                waited = time() - waitstart
+                if not extracting:
+                    stats['extract_wait'] += waited
+                if held_back:
+                    stats['fetch_wait'] += waited
+
+                for future in done:
+                    if future in fetching:
+                        source, ext_dest, extkwargs = fetching.pop(future)
+                        try:
+                            raw_dest = future.result()
+                        except Exception as e:
+                            errors.append((source, e))
+                            continue
+                        stats['fetched'] += 1
+                        if extkwargs is None:
+                            # streamed, raw_dest is the download() result
+                            yield raw_dest
+                        elif raw_dest is None:
+                            yield ext_dest, False
+                        else:
+                            future = extract_pool.submit(extract_archive, raw_dest, ext_dest, **extkwargs)
+                            extracting[future] = (source, ext_dest)
+                    else:
+                        source, ext_dest = extracting.pop(future)
+                        try:
+                            future.result()
+                        except Exception as e:
+                            errors.append((source, e))
+                            continue
+                        stats['extracted'] += 1
+                        yield ext_dest, True
+        print("Pipeline waits: extraction idle {0:.1f}s, downloads held back {1:.1f}s".format(
+            stats['extract_wait'], stats['fetch_wait']))
+        _raise_download_errors(errors, total)
+
+    def download_many(self, sources, **dlkwargs):
+        """
+        Queues all sources and downloads them concurrently, see download_queue().
+
+        :param sources:     urls from which to download data
+        :param dlkwargs:    keyword arguments for the download() method
+        :return: yields tuple(destination path (str), new_download? (bool))
+        """
+        for source in sources:
+            self.enqueue(source, **dlkwargs)
+        for result in self.download_queue():
+            yield result
+
+
+class MetadataSource(object):
+    """
+    Keeps a local copy of a bulk metadata CSV in sync with the USGS server using
+    conditional requests. The ETag/Last-Modified validators of the last transfer are
+    kept in a JSON sidecar next to the CSV, so checking an unchanged file costs a
+    single 304 round trip instead of a multi-GB download.
+    """
+
+    def __init__(self, url, local_path, session=None, chunk_size=1024 * 1024):
+        self.url = url
+        self.local_path = local_path
+        self.state_path = local_path + '.json'
+        self._session = session
+        self.chunk_size = chunk_size
+
+    @property
+    def session(self):
+        # created on first use, checking the state of the local copy needs no network
+        if self._session is None:
+            self._session = requests.Session()
+        return self._session
+
+    def _load_state(self):
+        if not os.path.exists(self.state_path):
+            return {}
+        with open(self.state_path) as f:
+            return json.load(f)
+
+    def _save_state(self, state):
+        with open(self.state_path, 'w') as f:
+            json.dump(state, f)
+
+    def last_checked(self):
+        """ returns the datetime of the last successful check against the server, if any """
+        state = self._load_state()
+        if 'checked' in state:
+            return datetime.strptime(state['checked'], '%Y-%m-%dT%H:%M:%S')
+        if os.path.exists(self.local_path):
+            return datetime.fromtimestamp(os.path.getmtime(self.local_path))
+        return None
+
+    def is_stale(self, end):
+        """
+        Tells whether the local copy may be missing scenes acquired up to `end`, i.e.
+        it was last checked before `end` and longer than METADATA_REFRESH_INTERVAL ago.
+
+        :param end: datetime of the latest acquisition needed
+        """
+        checked = self.last_checked()
+        if checked is None:
+            return True
+        age = (datetime.now() - checked).total_seconds()
+        return end > checked and age > METADATA_REFRESH_INTERVAL
+
+    def refresh(self, force=False):
+        """
+        Downloads the metadata file if it changed on the server since the last transfer.
+        The body is requested with gzip transfer encoding and written through a .part
+        file, so an interrupted transfer never leaves a truncated CSV behind.
+
+        :param force:   set to True to skip the conditional headers
+        :return:        True if a new copy was downloaded, False on 304 Not Modified
+        """
+        state = self._load_state()
+        headers = {'Accept-Encoding': 'gzip, deflate'}
+        if not force and os.path.exists(self.local_path):
+            if state.get('etag'):
+                headers['If-None-Match'] = state['etag']
+            if state.get('last_modified'):
+                headers['If-Modified-Since'] = state['last_modified']
+
+        response = self.session.get(self.url, headers=headers, stream=True, timeout=60)
+        try:
+            if response.status_code == 304:
+                print("{0} is up to date".format(self.url))
+                fresh = False
+            else:
+                response.raise_for_status()
+                part = self.local_path + '.part'
+                with open(part, 'wb') as of:
+                    # iter_content undoes the gzip transfer encoding on the fly
+                    for block in response.iter_content(self.chunk_size):
+                        of.write(block)
+                os.replace(part, self.local_path)
+                state['etag'] = response.headers.get('ETag')
+                state['last_modified'] = response.headers.get('Last-Modified')
+                fresh = True
+        finally:
+            response.close()
+
+        state['checked'] = datetime.now().strftime('%Y-%m-%dT%H:%M:%S')
+        self._save_state(state)
+        return fresh
+
+
+def _connect(db_name, timeout=SQLITE_BUSY_TIMEOUT, check_same_thread=True):
+    """
+    Opens a catalog or order cache database for use by many processes at once. In WAL
+    mode readers never block the writer nor each other, and a writer waits up to
+    timeout seconds for another one to finish instead of failing with 'database is
+    locked', so writes must be kept to short transactions.
+
+    :param db_name:             path to the database
+    :param timeout:             seconds to wait for a lock held by another connection
+    :param check_same_thread:   use False for a connection handed between threads, one
+                                thread at a time
+    :return: sqlite3 connection
+    """
+    conn = sqlite3.connect(db_name, timeout=timeout, check_same_thread=check_same_thread)
+    if db_name != ':memory:':
+        # the journal mode is persistent, this is a no-op once the database is in WAL
+        mode = conn.execute("PRAGMA journal_mode=%s" % CATALOG_JOURNAL_MODE).fetchone()[0]
+        if mode.upper() == 'WAL':
+            conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+@contextmanager
+def _transaction(conn):
+    """
+    Short write transaction. BEGIN IMMEDIATE takes the write lock up front, waiting for
+    it through the busy timeout, where a deferred transaction could fail right away in
+    WAL mode when another process commits between its read and its first write.
+    """
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+    except Exception:
+        conn.rollback()
+        raise
+    conn.commit()
+
+
+@contextmanager
+def _catalog_lock(db_name, suffix='.lock'):
+    """
+    Exclusive inter-process lock on a catalog, held while its metadata CSV is refreshed
+    and the catalog built or refreshed from it, so concurrent jobs download and load a
+    new CSV only once. lockf() locks are honoured over NFS, unlike flock().
+
+    :param db_name:     path to the catalog database
+    :param suffix:      suffix of the lock file, one per kind of exclusive operation
+    """
+    if fcntl is None:
+        yield
+        return
+    with open(db_name + suffix, 'a') as lockfile:
+        fcntl.lockf(lockfile, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.lockf(lockfile, fcntl.LOCK_UN)
+
+
+def _open_order_cache(cache_db):
+    conn = _connect(cache_db)
+    conn.execute("CREATE TABLE IF NOT EXISTS orders (orderid TEXT PRIMARY KEY, final INTEGER, fetched REAL)")
+    conn.execute("CREATE TABLE IF NOT EXISTS order_items (orderid TEXT, productID TEXT, status TEXT, "
+                 "product_dload_url TEXT, cksum_download_url TEXT, PRIMARY KEY (orderid, productID))")
+    conn.execute("CREATE INDEX IF NOT EXISTS order_items_productID_idx ON order_items (productID)")
+    return conn
+
 
-    #    usr = api_request('user')
+def check_order_cache(auth, cache_db=None, ttl=ORDER_CACHE_TTL, max_workers=8):
+    """
+    Returns the inventory of the user's complete and ordered ESPA orders as a DataFrame
+    with one row per item (orderid, productID, status, product_dload_url). The item
+    status of the orders is fetched concurrently through the shared EspaClient.
+
+    With a cache_db the inventory is kept in a local SQLite table: orders whose items
+    are all final (complete, purged, ...) are never fetched again, and orders still in
+    flight are only refreshed once their cached status is older than ttl seconds.
+
+    :param auth:        tuple(usgs username, usgs password)
+    :param cache_db:    optional path to the SQLite order cache
+    :param ttl:         seconds an in-flight order's cached status stays valid
+    :param max_workers: number of concurrent item-status requests
+    """
+    def fetch(endpoint, body=None):
+        resp = espa_api(endpoint, body=body, uauth=auth)
+        if resp is None:
+            raise Exception("ESPA request {0} failed".format(endpoint))
+        return resp
 
-    #    order_list = api_request('list-orders/%s' % usr['email'])
     filters = {"status": ["complete", "ordered"]}  # Here, we ignore any purged orders
-    order_list = espa_api('list-orders', body=filters)
-    orderID = []
-    fName = []
-    order_status = []
-    #    for i in range(len(order_list['orders'])):
-    #        orderid = order_list['orders'][i]
-    for i in range(len(order_list)):
-        orderid = order_list[i]
-        resp = espa_api('item-status/{0}'.format(orderid))
-        ddd = json.loads(json.dumps(resp))
-        #        if not ddd['orderid']['%s' % orderid][0]['status']=='purged':
-        for j in range(len(ddd['%s' % orderid])):
-            fname = ddd['%s' % orderid][j]['name']
-            status = ddd['%s' % orderid][j]['status']
-            orderID.append(orderid)
-            fName.append(fname)
-            order_status.append(status)
-
-    output = {'orderid': orderID, 'productID': fName, 'status': order_status}
-    outDF = pd.DataFrame(output)
+    order_list = list(fetch('list-orders', body=filters))
+
+    conn = _open_order_cache(cache_db or ':memory:')
+    now = time()
+    cached = dict((orderid, (final, fetched)) for orderid, final, fetched
+                  in conn.execute("SELECT orderid, final, fetched FROM orders"))
+    stale = [orderid for orderid in order_list
+             if orderid not in cached or (not cached[orderid][0] and now - cached[orderid][1] > ttl)]
+
+    if stale:
+        print("Fetching the status of {0} of {1} orders".format(len(stale), len(order_list)))
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            responses = list(pool.map(lambda orderid: fetch('item-status/{0}'.format(orderid)), stale))
+        with _transaction(conn):
+            for orderid, resp in zip(stale, responses):
+                items = resp.get(orderid, [])
+                final = all(item['status'] in ORDER_FINAL_STATUSES for item in items)
+                conn.execute("DELETE FROM order_items WHERE orderid = ?", (orderid,))
+                conn.executemany("INSERT INTO order_items VALUES (?, ?, ?, ?, ?)",
+                                 [(orderid, item['name'], item['status'], item.get('product_dload_url'),
+                                   item.get('cksum_download_url')) for item in items])
+                conn.execute("INSERT OR REPLACE INTO orders VALUES (?, ?, ?)", (orderid, int(final), now))
+
+    # orders purged since they were cached are no longer listed and drop out here
+    conn.execute("CREATE TEMP TABLE listed (orderid TEXT PRIMARY KEY)")
+    conn.executemany("INSERT OR IGNORE INTO listed VALUES (?)", [(orderid,) for orderid in order_list])
+    outDF = pd.read_sql_query("SELECT order_items.orderid, productID, status, product_dload_url "
+                              "FROM order_items JOIN temp.listed ON order_items.orderid = listed.orderid", conn)
+    conn.close()
 
     return outDF
 
 
-def search(lat, lon, start_date, end_date, cloud, available, cacheDir, sat):
-    columns = ['acquisitionDate', 'acquisitionDate','upperLeftCornerLatitude', 'upperLeftCornerLongitude',
-               'lowerRightCornerLatitude' , 'lowerRightCornerLongitude', 'cloudCover']
-    end = datetime.strptime(end_date, '%Y-%m-%d')
+def _index_catalog(conn, rebuild=False):
+    """
+    Creates the indexes search() relies on for the raw_data table: an R*Tree over the
+    scene corner coordinates, a composite index over the attribute filters and the
+    unique sceneID index refresh_catalog() upserts against, the LANDSAT_PRODUCT_ID
+    index used by searchProduct() and register_scenes() and the index of the cached
+    products evict_cache() walks. Catalogs built before the cache_bytes and last_access
+    columns existed get them here. The
+    R*Tree is keyed on the raw_data rowid, so it must be rebuilt whenever raw_data is
+    rewritten.
+
+    :param conn:        open sqlite3 connection to the catalog database
+    :param rebuild:     set to True to repopulate the R*Tree even if it already exists
+    """
+    cur = conn.cursor()
+    exists = cur.execute("SELECT name FROM sqlite_master WHERE type='table' "
+                         "AND name='raw_data_rtree'").fetchone()
+    columns = [row[1] for row in cur.execute("PRAGMA table_info(raw_data)")]
+    if 'cache_bytes' not in columns:
+        cur.execute("ALTER TABLE raw_data ADD COLUMN cache_bytes INTEGER DEFAULT 0")
+    if 'last_access' not in columns:
+        cur.execute("ALTER TABLE raw_data ADD COLUMN last_access REAL")
+    cur.execute("CREATE INDEX IF NOT EXISTS raw_data_filter_idx ON raw_data "
+                "(sr, acquisitionDate, cloudCover, sensor)")
+    cur.execute("CREATE UNIQUE INDEX IF NOT EXISTS raw_data_sceneID_idx ON raw_data (sceneID)")
+    cur.execute("CREATE INDEX IF NOT EXISTS raw_data_productID_idx ON raw_data (LANDSAT_PRODUCT_ID)")
+    cur.execute("CREATE INDEX IF NOT EXISTS raw_data_cached_idx ON raw_data (last_access) "
+                "WHERE local_file_path != ''")
+    cur.execute("CREATE VIRTUAL TABLE IF NOT EXISTS raw_data_rtree USING rtree("
+                "id, minLat, maxLat, minLon, maxLon)")
+    if rebuild or not exists:
+        cur.execute("DELETE FROM raw_data_rtree")
+        cur.execute("INSERT INTO raw_data_rtree " + RAW_DATA_RTREE_ROWS)
+    conn.commit()
+
+
+def _bump_catalog_version(conn):
+    """ increments the catalog version, call inside the transaction that changes raw_data """
+    conn.execute("CREATE TABLE IF NOT EXISTS catalog_meta (key TEXT PRIMARY KEY, value INTEGER)")
+    conn.execute("INSERT INTO catalog_meta VALUES ('version', 1) "
+                 "ON CONFLICT(key) DO UPDATE SET value = value + 1")
+
+
+def catalog_version(conn):
+    """ returns the version of the catalog, it changes whenever raw_data is written to """
+    try:
+        row = conn.execute("SELECT value FROM catalog_meta WHERE key = 'version'").fetchone()
+    except sqlite3.OperationalError:
+        return 0
+    return row[0] if row else 0
+
+
+def _metadata_paths(sat, cacheDir):
+    """ returns the bulk metadata url, local csv path and catalog database path for a satellite """
     # this is a landsat-util work around when it fails
     if sat == 7:
-        metadataUrl = 'https://landsat.usgs.gov/landsat/metadata_service/bulk_metadata_files/LANDSAT_ETM_C1.csv'
+        metadataUrl = metadata_host + 'LANDSAT_ETM_C1.csv'
     else:
-        metadataUrl = 'https://landsat.usgs.gov/landsat/metadata_service/bulk_metadata_files/LANDSAT_8_C1.csv'
-
-    fn = os.path.join(cacheDir, metadataUrl.split(os.sep)[-1])
-    # looking to see if metadata CSV is available and if its up to the date needed
-    if os.path.exists(fn):
-        d = datetime.fromtimestamp(os.path.getmtime(fn))
-        db_name = os.path.join(cacheDir, fn.split(os.sep)[-1][:-4] + '.db')
-        if not os.path.exists(db_name):
-            orig_df = pd.read_csv(fn, usecols=columns)
-            orig_df['sr'] = pd.Series(np.tile('N', len(orig_df)))
-            orig_df['bt'] = pd.Series(np.tile('N', len(orig_df)))
-            orig_df['local_file_path'] = ''
-            conn = sqlite3.connect(db_name)
-            orig_df.to_sql("raw_data", conn, if_exists="replace", index=False)
-            conn.close()
-        #            orig_df = pd.read_sql_query("SELECT * from raw_data",conn)
-
-        if (end.year > d.year) and (end.month > d.month) and (end.day > d.day):
-            wget.download(metadataUrl, out=fn)
-            metadata = pd.read_csv(fn, usecols=columns)
-            metadata['sr'] = pd.Series(np.tile('N', len(metadata)))
-            metadata['bt'] = pd.Series(np.tile('N', len(metadata)))
-            orig_df = pd.read_sql_query("SELECT * from raw_data", conn)
-            orig_df = orig_df.append(metadata, ignore_index=True)
-            orig_df = orig_df.drop_duplicates(subset='sceneID', keep='first')
-            orig_df.to_sql("raw_data", conn, if_exists="replace", index=False)
-    else:
-        wget.download(metadataUrl, out=fn)
-        db_name = os.path.join(cacheDir, fn.split(os.sep)[-1][:-4] + '.db')
-        conn = sqlite3.connect(db_name)
-        metadata = pd.read_csv(fn, usecols=columns)
-        metadata['sr'] = pd.Series(np.tile('N', len(metadata)))
-        metadata['bt'] = pd.Series(np.tile('N', len(metadata)))
-        metadata['local_file_path'] = ''
-        metadata.to_sql("raw_data", conn, if_exists="replace", index=False)
+        metadataUrl = metadata_host + 'LANDSAT_8_C1.csv'
+    fn = os.path.join(cacheDir, metadataUrl.split('/')[-1])
+    db_name = fn[:-4] + '.db'
+    return metadataUrl, fn, db_name
+
+
+def build_catalog(csv_fn, db_name, chunksize=CATALOG_CHUNKSIZE):
+    """
+    (Re)builds the raw_data catalog table from a bulk metadata CSV. The CSV is streamed
+    in chunks of explicit dtypes and inserted in batches inside a single transaction,
+    so peak memory is bounded by the chunk size rather than the size of the CSV.
+
+    :param csv_fn:      path to the bulk metadata CSV
+    :param db_name:     path to the catalog database
+    :param chunksize:   number of CSV rows read and inserted per batch
+    :return:            number of rows loaded
+    """
+    insert = "INSERT INTO raw_data ({0}) VALUES ({1})".format(", ".join(CATALOG_COLUMNS),
+                                                            ", ".join("?" * len(CATALOG_COLUMNS)))
+    conn = _connect(db_name)
+    cur = conn.cursor()
+    nrows = 0
+    starttime = time()
+    try:
+        # one transaction for the drop, the load and the indexes: concurrent readers keep
+        # seeing the old catalog until the new one is complete
+        cur.execute("BEGIN IMMEDIATE")
+        cur.execute("DROP TABLE IF EXISTS raw_data")
+        cur.execute(RAW_DATA_SCHEMA)
+        for chunk in pd.read_csv(csv_fn, usecols=CATALOG_COLUMNS, dtype=CATALOG_DTYPES, chunksize=chunksize):
+            cur.executemany(insert, chunk[CATALOG_COLUMNS].itertuples(index=False, name=None))
+            nrows += len(chunk)
+            elapsed_time = max(time() - starttime, 1e-6)
+            print("Loaded {0} rows ({1:.0f} rows/s)".format(nrows, nrows / elapsed_time))
+        _bump_catalog_version(conn)
+        _index_catalog(conn, rebuild=True)
+    except Exception:
+        conn.rollback()
+        conn.close()
+        raise
+    conn.close()
+    return nrows
+
+
+def refresh_catalog(csv_fn, db_name, chunksize=CATALOG_CHUNKSIZE):
+    """
+    Brings an existing catalog up to date with a newer bulk metadata CSV. Only the CSV
+    rows at or past the catalog's high-water mark (the latest dateUpdated, or the latest
+    acquisitionDate for catalogs built before dateUpdated was kept) are upserted, keyed
+    on sceneID. The sr/bt/local_file_path state of existing scenes is left untouched.
+
+    The CSV is scanned into a temp table without holding the catalog's write lock, the
+    rows are then upserted in one short transaction, so concurrent writers only wait for
+    the new rows and an interrupted refresh leaves the catalog as it was.
+
+    :param csv_fn:      path to the refreshed bulk metadata CSV
+    :param db_name:     path to the catalog database
+    :param chunksize:   number of CSV rows read and staged per batch
+    :return:            number of rows upserted
+    """
+    conn = _connect(db_name)
+    _index_catalog(conn)
+    cur = conn.cursor()
+    columns = [row[1] for row in cur.execute("PRAGMA table_info(raw_data)")]
+    if 'dateUpdated' not in columns:
+        with _transaction(conn):
+            cur.execute("ALTER TABLE raw_data ADD COLUMN dateUpdated TEXT")
+    hwm_column = 'dateUpdated'
+    hwm = cur.execute("SELECT MAX(dateUpdated) FROM raw_data").fetchone()[0]
+    if hwm is None:
+        hwm_column = 'acquisitionDate'
+        hwm = cur.execute("SELECT MAX(acquisitionDate) FROM raw_data").fetchone()[0]
+    conn.commit()
+
+    names = ", ".join(CATALOG_COLUMNS)
+    updates = ", ".join("{0} = excluded.{0}".format(c) for c in CATALOG_COLUMNS if c != 'sceneID')
+    stage = "INSERT INTO temp.refresh_rows ({0}) VALUES ({1})".format(names, ", ".join("?" * len(CATALOG_COLUMNS)))
+    # WHERE true tells the parser the ON CONFLICT clause belongs to the INSERT
+    upsert = ("INSERT INTO raw_data ({0}) SELECT {0} FROM temp.refresh_rows WHERE true ORDER BY rowid "
+              "ON CONFLICT(sceneID) DO UPDATE SET {1}".format(names, updates))
+    # upserts keep the rowid of existing scenes, so the R*Tree only needs the touched rows
+    rtree_upsert = ("INSERT OR REPLACE INTO raw_data_rtree " + RAW_DATA_RTREE_ROWS +
+                    " AND sceneID IN (SELECT sceneID FROM temp.refresh_rows)")
+    nrows = 0
+    starttime = time()
+    try:
+        cur.execute("CREATE TEMP TABLE refresh_rows ({0})".format(names))
+        for chunk in pd.read_csv(csv_fn, usecols=CATALOG_COLUMNS, dtype=CATALOG_DTYPES, chunksize=chunksize):
+            if hwm is not None:
+                chunk = chunk[chunk[hwm_column] >= hwm]
+            if chunk.empty:
+                continue
+            # writes to the temp database take no lock on the catalog
+            cur.executemany(stage, chunk[CATALOG_COLUMNS].itertuples(index=False, name=None))
+            conn.commit()
+            nrows += len(chunk)
+        if nrows:
+            with _transaction(conn):
+                cur.execute(upsert)
+                cur.execute(rtree_upsert)
+                _bump_catalog_version(conn)
+    finally:
         conn.close()
-    conn = sqlite3.connect(db_name)
+    elapsed_time = max(time() - starttime, 1e-6)
+    print("Upserted {0} rows newer than {1} ({2:.0f} rows/s)".format(nrows, hwm, nrows / elapsed_time))
+    return nrows
+
+
+def _get_catalog(sat, cacheDir, end=None):
+    """
+    Makes sure the catalog database for a satellite exists, downloading the bulk metadata
+    CSV and building the catalog if needed, and returns the path to the database.
+
+    :param sat:         landsat satellite number, i.e. 7 or 8
+    :param cacheDir:    directory holding the metadata CSV and catalog database
+    :param end:         optional datetime, the metadata is refreshed if it is older
+    :return:            path to the catalog database
+    """
+    metadataUrl, fn, db_name = _metadata_paths(sat, cacheDir)
+    source = MetadataSource(metadataUrl, fn)
+    if not (os.path.exists(fn) and os.path.exists(db_name) and (end is None or not source.is_stale(end))):
+        # only one process downloads and loads the metadata, the others wait for it and
+        # find the catalog up to date once they get the lock
+        with _catalog_lock(db_name):
+            # looking to see if metadata CSV is available and if its up to the date needed
+            if not os.path.exists(fn):
+                source.refresh()
+                if os.path.exists(db_name):
+                    # the CSV was deleted to save space, upsert so the sr/bt/local_file_path
+                    # state of the scenes already registered survives
+                    refresh_catalog(fn, db_name)
+                else:
+                    build_catalog(fn, db_name)
+                return db_name
+            if not os.path.exists(db_name):
+                build_catalog(fn, db_name)
+            if end is not None and source.is_stale(end):
+                try:
+                    fresh = source.refresh()
+                except OSError as e:
+                    # requests errors are OSErrors too, the catalog we have still answers
+                    logging.warning("Could not refresh %s, searching the existing catalog: %s", source.url, e)
+                    fresh = False
+                if fresh:
+                    refresh_catalog(fn, db_name)
+    # catalogs built by earlier versions get their indexes on first use
+    conn = _connect(db_name)
+    _index_catalog(conn)
+    conn.close()
+    return db_name
+
+
+def _scene_query(columns, box, start_date, end_date, cloud, available, sat, point=None, tables=''):
+    """
+    Returns the SQL and parameters of the catalog searches, shared by search(),
+    search_aoi() and search_sites(). The R*Tree narrows the candidates to the scenes
+    whose corner box intersects box, the exact corner test against point and the
+    attribute filters run on that small set only. CROSS JOIN pins the R*Tree as the
+    outer loop of the query plan, after the tables joined in front of it.
+
+    Coordinates are bound as parameters, or used as they are when given as the SQL
+    expression of a column, e.g. 'sites.lat'.
+
+    :param columns:     SELECT list
+    :param box:         (minLat, maxLat, minLon, maxLon) the corner box of a scene must intersect
+    :param start_date:  start date yyyy-mm-dd
+    :param end_date:    end date yyyy-mm-dd (exclusive)
+    :param cloud:       maximum cloud cover
+    :param available:   'Y' or 'N' for scenes (not) on the local system, None for both
+    :param sat:         landsat satellite number, i.e. 7 or 8
+    :param point:       optional (lat, lon) that must lie inside the corners of a scene
+    :param tables:      tables joined before the R*Tree, e.g. 'temp.sites CROSS JOIN '
+    :return: tuple(query, params)
+    """
+    params = []
+
+    def coordinate(value):
+        if isinstance(value, str):
+            return value
+        params.append(value)
+        return '?'
+
+    minLat, maxLat, minLon, maxLon = box
+    where = ["(raw_data_rtree.minLat <= {0})".format(coordinate(maxLat)),
+             "(raw_data_rtree.maxLat >= {0})".format(coordinate(minLat)),
+             "(raw_data_rtree.minLon <= {0})".format(coordinate(maxLon)),
+             "(raw_data_rtree.maxLon >= {0})".format(coordinate(minLon)),
+             "(acquisitionDate >= ?)", "(acquisitionDate < ?)"]
+    params.extend([start_date, end_date])
+    if point is not None:
+        lat, lon = point
+        where += ["(upperLeftCornerLatitude > {0})".format(coordinate(lat)),
+                  "(upperLeftCornerLongitude < {0})".format(coordinate(lon)),
+                  "(lowerRightCornerLatitude < {0})".format(coordinate(lat)),
+                  "(lowerRightCornerLongitude > {0})".format(coordinate(lon))]
+    where.append("(cloudCover <= ?)")
+    params.append(cloud)
+    if available is not None:
+        where.append("(sr = ?)")
+        params.append(available)
     if sat == 8:
-        output = pd.read_sql_query("SELECT * from raw_data WHERE (acquisitionDate >= '%s')"
-                                   "AND (acquisitionDate < '%s') AND (upperLeftCornerLatitude > %f )"
-                                   "AND (upperLeftCornerLongitude < %f ) AND "
-                                   "(lowerRightCornerLatitude < %f) AND "
-                                   "(lowerRightCornerLongitude > %f) AND "
-                                   "(cloudCover <= %d) AND (sr = '%s') AND "
-                                   "(sensor = 'OLI_TIRS')" %
-                                   (start_date, end_date, lat, lon, lat, lon, cloud, available), conn)
-    else:
-        output = pd.read_sql_query("SELECT * from raw_data WHERE (acquisitionDate >= '%s')"
-                                   "AND (acquisitionDate < '%s') AND (upperLeftCornerLatitude > %f )"
-                                   "AND (upperLeftCornerLongitude < %f ) AND "
-                                   "(lowerRightCornerLatitude < %f) AND "
-                                   "(lowerRightCornerLongitude > %f) AND "
-                                   "(cloudCover <= %d) AND (sr = '%s')" %
-                                   (start_date, end_date, lat, lon, lat, lon, cloud, available), conn)
+        where.append("(sensor = 'OLI_TIRS')")
+    query = ("SELECT {0} FROM {1}raw_data_rtree CROSS JOIN raw_data ON raw_data.rowid = raw_data_rtree.id "
+             "WHERE {2}".format(columns, tables, " AND ".join(where)))
+    return query, params
+
+
+def _search_query(lat, lon, start_date, end_date, cloud, available, sat):
+    """ returns the SQL and parameters of search() """
+    return _scene_query("raw_data.*", (lat, lat, lon, lon), start_date, end_date, cloud, available, sat,
+                        point=(lat, lon))
+
+
+def search(lat, lon, start_date, end_date, cloud, available, cacheDir, sat):
+    end = datetime.strptime(end_date, '%Y-%m-%d')
+    db_name = _get_catalog(sat, cacheDir, end)
+    conn = _connect(db_name)
+    query, params = _search_query(lat, lon, start_date, end_date, cloud, available, sat)
+    output = pd.read_sql_query(query, conn, params=params)
     conn.close()
     return output
 
 
-def searchProduct(productID, db_path, sat):
-    columns = ['acquisitionDate', 'acquisitionDate','upperLeftCornerLatitude', 'upperLeftCornerLongitude',
-               'lowerRightCornerLatitude' , 'lowerRightCornerLongitude', 'cloudCover']
-    if sat == 7:
-        metadataUrl = 'https://landsat.usgs.gov/landsat/metadata_service/bulk_metadata_files/LANDSAT_ETM_C1.csv'
-        db_name = os.path.join(db_path, 'LANDSAT_ETM_C1.db')
+def _points_in_polygon(lon, lat, polygon):
+    """
+    Vectorized even-odd test of which points fall inside a polygon.
+
+    :param lon:         array of point longitudes
+    :param lat:         array of point latitudes
+    :param polygon:     sequence of (lon, lat) vertices
+    :return: boolean array
+    """
+    vertices = np.asarray(polygon, dtype=float)
+    x0, y0 = vertices[:, 0], vertices[:, 1]
+    x1, y1 = np.roll(x0, -1), np.roll(y0, -1)
+    px, py = lon[:, np.newaxis], lat[:, np.newaxis]
+    crosses = (y0 > py) != (y1 > py)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        xcross = x0 + (py - y0) * (x1 - x0) / (y1 - y0)
+    return np.logical_xor.reduce(crosses & (px < xcross), axis=1)
+
+
+def search_aoi(aoi, start_date, end_date, cloud, available, cacheDir, sat, resolution=64, min_cover=False):
+    """
+    Searches the catalog for the scenes whose footprint intersects an area of interest
+    and reports which fraction of the area each scene covers. Candidates come from the
+    R*Tree, the footprint test then runs vectorized over all candidates at once. For a
+    bbox the coverage is exact, for a polygon it is measured on a resolution x resolution
+    grid of sample points inside the polygon.
+
+    :param aoi:         bbox (minLon, minLat, maxLon, maxLat) or polygon [(lon, lat), ...]
+    :param start_date:  start date yyyy-mm-dd
+    :param end_date:    end date yyyy-mm-dd (exclusive)
+    :param cloud:       maximum cloud cover
+    :param available:   'Y' or 'N' for scenes (not) on the local system, None for both
+    :param cacheDir:    directory holding the metadata CSV and catalog database
+    :param sat:         landsat satellite number, i.e. 7 or 8
+    :param resolution:  number of sample points per side of the area of interest
+    :param min_cover:   use True to only return a small set of scenes that covers as much
+                        of the area as the candidates do, picked greedily by coverage and
+                        then by cloud cover
+    :return: DataFrame of the catalog rows plus a coverage column, by descending coverage
+    """
+    aoi = np.asarray(aoi, dtype=float)
+    if aoi.ndim == 1:
+        minLon, minLat, maxLon, maxLat = aoi
+        polygon = None
     else:
-        metadataUrl = 'https://landsat.usgs.gov/landsat/metadata_service/bulk_metadata_files/LANDSAT_8_C1.csv'
-        db_name = os.path.join(db_path, 'LANDSAT_8_C1.db')
-
-    fn = os.path.join(db_path, metadataUrl.split(os.sep)[-1])
-    if not os.path.exists(db_name):
-        if not os.path.exists(fn):
-            wget.download(metadataUrl, out=fn)
-        conn = sqlite3.connect(db_name)
-        orig_df = pd.read_csv(fn, usecols=columns)
-        orig_df['sr'] = pd.Series(np.tile('N', len(orig_df)))
-        orig_df['bt'] = pd.Series(np.tile('N', len(orig_df)))
-        orig_df['local_file_path'] = ''
-        orig_df.to_sql("raw_data", conn, if_exists="replace", index=False)
-        conn.close()
+        polygon = aoi
+        minLon, minLat = aoi.min(axis=0)
+        maxLon, maxLat = aoi.max(axis=0)
 
-    conn = sqlite3.connect(db_name)
-    output = pd.read_sql_query("SELECT * from raw_data WHERE (LANDSAT_PRODUCT_ID == '%s')" % productID, conn)
+    end = datetime.strptime(end_date, '%Y-%m-%d')
+    db_name = _get_catalog(sat, cacheDir, end)
+    conn = _connect(db_name)
+    query, params = _scene_query("raw_data.*", (minLat, maxLat, minLon, maxLon), start_date, end_date, cloud,
+                                 available, sat)
+    candidates = pd.read_sql_query(query, conn, params=params)
+    conn.close()
+
+    top = candidates.upperLeftCornerLatitude.values[:, np.newaxis]
+    left = candidates.upperLeftCornerLongitude.values[:, np.newaxis]
+    bottom = candidates.lowerRightCornerLatitude.values[:, np.newaxis]
+    right = candidates.lowerRightCornerLongitude.values[:, np.newaxis]
+
+    # sample points of the area of interest, one row of the footprint test per candidate
+    lons, lats = np.meshgrid(np.linspace(minLon, maxLon, resolution), np.linspace(minLat, maxLat, resolution))
+    lons, lats = lons.ravel(), lats.ravel()
+    if polygon is not None:
+        inside = _points_in_polygon(lons, lats, polygon)
+        lons, lats = lons[inside], lats[inside]
+    covered = (bottom <= lats) & (lats <= top) & (left <= lons) & (lons <= right)
+
+    if polygon is None:
+        width = np.clip(np.minimum(right[:, 0], maxLon) - np.maximum(left[:, 0], minLon), 0, None)
+        height = np.clip(np.minimum(top[:, 0], maxLat) - np.maximum(bottom[:, 0], minLat), 0, None)
+        area = max((maxLon - minLon) * (maxLat - minLat), 1e-12)
+        coverage = width * height / area
+        # a degenerate bbox (a point or a line) has no area, fall back to the samples
+        if (maxLon - minLon) * (maxLat - minLat) == 0:
+            coverage = covered.mean(axis=1) if lons.size else np.zeros(len(candidates))
+    else:
+        coverage = covered.mean(axis=1) if lons.size else np.zeros(len(candidates))
+    candidates['coverage'] = coverage
+    keep = candidates.coverage.values > 0
+    candidates, covered = candidates[keep], covered[keep]
+
+    if min_cover and len(candidates):
+        chosen = []
+        uncovered = np.ones(covered.shape[1], dtype=bool)
+        clouds = candidates.cloudCover.values
+        while uncovered.any():
+            gain = (covered & uncovered).sum(axis=1)
+            if gain.max() == 0:
+                break
+            best = np.lexsort((clouds, -gain))[0]
+            chosen.append(best)
+            uncovered &= ~covered[best]
+        candidates = candidates.iloc[chosen]
+
+    return candidates.sort_values('coverage', ascending=False).reset_index(drop=True)
+
+
+def _read_sites(sites):
+    """
+    Normalises the site input of search_sites() to a DataFrame with site, lat and lon
+    columns. Accepts a CSV path, a DataFrame with lat/lon (and optionally site) columns,
+    or an array of (lat, lon) or (site, lat, lon) rows.
+    """
+    if isinstance(sites, str):
+        sites = pd.read_csv(sites)
+    if not isinstance(sites, pd.DataFrame):
+        rows = np.asarray(sites, dtype=object)
+        if rows.ndim != 2 or rows.shape[1] not in (2, 3):
+            raise ValueError("sites must be (lat, lon) or (site, lat, lon) rows")
+        sites = pd.DataFrame(rows, columns=['lat', 'lon'] if rows.shape[1] == 2 else ['site', 'lat', 'lon'])
+    if 'site' not in sites.columns:
+        sites = sites.assign(site=sites.index)
+    return pd.DataFrame({'site': sites.site.astype(str), 'lat': sites.lat.astype(float),
+                         'lon': sites.lon.astype(float)})
+
+
+def search_sites(sites, start_date, end_date, cloud, cacheDir, sat, available=None):
+    """
+    Searches the catalog for many sites at once. The sites are loaded into a temporary
+    table and matched against the R*Tree in a single query, returning one row per
+    (site, scene) pair, whether the scene is available locally or not.
+
+    :param sites:       CSV path, DataFrame or array of sites, see _read_sites()
+    :param start_date:  start date yyyy-mm-dd
+    :param end_date:    end date yyyy-mm-dd (exclusive)
+    :param cloud:       maximum cloud cover
+    :param cacheDir:    directory holding the metadata CSV and catalog database
+    :param sat:         landsat satellite number, i.e. 7 or 8
+    :param available:   optional 'Y' or 'N' to only return scenes (not) on the local system
+    :return: DataFrame(site, sceneID, LANDSAT_PRODUCT_ID, acquisitionDate, cloudCover,
+             available, local_file_path)
+    """
+    sites = _read_sites(sites)
+    end = datetime.strptime(end_date, '%Y-%m-%d')
+    db_name = _get_catalog(sat, cacheDir, end)
+    conn = _connect(db_name)
+    conn.execute("CREATE TEMP TABLE sites (site TEXT, lat REAL, lon REAL)")
+    conn.executemany("INSERT INTO temp.sites VALUES (?, ?, ?)", sites.itertuples(index=False, name=None))
+    # the sites drive the join, each one probes the R*Tree like a single search() does
+    query, params = _scene_query("sites.site, raw_data.sceneID, raw_data.LANDSAT_PRODUCT_ID, "
+                                 "raw_data.acquisitionDate, raw_data.cloudCover, raw_data.sr AS available, "
+                                 "raw_data.local_file_path",
+                                 ('sites.lat', 'sites.lat', 'sites.lon', 'sites.lon'), start_date, end_date, cloud,
+                                 available, sat, point=('sites.lat', 'sites.lon'), tables='temp.sites CROSS JOIN ')
+    output = pd.read_sql_query(query, conn, params=params)
     conn.close()
     return output
 
 
-def updateDB(dbRows, paths, cacheDir, sat):
-    columns = ['acquisitionDate', 'acquisitionDate','upperLeftCornerLatitude', 'upperLeftCornerLongitude',
-               'lowerRightCornerLatitude' , 'lowerRightCornerLongitude', 'cloudCover']
-    end = datetime.strptime(str(dbRows.acquisitionDate.values[0]), '%Y-%m-%d')
-    # this is a landsat-util work around when it fails
-    if sat == 7:
-        metadataUrl = 'https://landsat.usgs.gov/landsat/metadata_service/bulk_metadata_files/LANDSAT_ETM_C1.csv'
+def select_best_scenes(scenes, k=1, window=16, by='cloud', start_date=None):
+    """
+    Thins search results down to the best k scenes per WRS-2 path/row per time window,
+    so overlapping acquisitions of the same path/row a few days apart are not all
+    ordered. The selection is a single sort plus a grouped head() over the frame.
+
+    :param scenes:      search results with LANDSAT_PRODUCT_ID, acquisitionDate and cloudCover
+    :param k:           number of scenes to keep per path/row and window
+    :param window:      length of the time windows in days
+    :param by:          'cloud' to keep the least cloudy scenes of each window, or 'date' to
+                        keep the scenes closest to the start of each window (for a regular
+                        cadence), ties broken by cloud cover
+    :param start_date:  optional yyyy-mm-dd the windows start from, the first acquisition
+                        date if None
+    :return: the selected rows of scenes, in their original order
+    """
+    if scenes.empty:
+        return scenes
+    dates = pd.to_datetime(scenes.acquisitionDate)
+    origin = pd.Timestamp(start_date) if start_date is not None else dates.min()
+    offset = (dates - origin).dt.days
+    ranking = pd.DataFrame({'pathrow': scenes.LANDSAT_PRODUCT_ID.str.slice(10, 16).values,
+                            'window': (offset // window).values,
+                            'lag': (offset % window).values,
+                            'cloud': scenes.cloudCover.values}, index=scenes.index)
+    if by == 'cloud':
+        order = ['cloud', 'lag']
+    elif by == 'date':
+        order = ['lag', 'cloud']
     else:
-        metadataUrl = 'https://landsat.usgs.gov/landsat/metadata_service/bulk_metadata_files/LANDSAT_8_C1.csv'
-
-    fn = os.path.join(cacheDir, metadataUrl.split(os.sep)[-1])
-    # looking to see if metadata CSV is available and if its up to the date needed
-    if os.path.exists(fn):
-        d = datetime.fromtimestamp(os.path.getmtime(fn))
-        db_name = os.path.join(cacheDir, fn.split(os.sep)[-1][:-4] + '.db')
-        if not os.path.exists(db_name):
-            orig_df = pd.read_csv(fn, usecols=columns)
-            orig_df['sr'] = pd.Series(np.tile('N', len(orig_df)))
-            orig_df['bt'] = pd.Series(np.tile('N', len(orig_df)))
-            orig_df['local_file_path'] = ''
-            conn = sqlite3.connect(db_name)
-            orig_df.to_sql("raw_data", conn, if_exists="replace", index=False)
+        raise ValueError("by must be 'cloud' or 'date'")
+    best = ranking.sort_values(order, kind='mergesort').groupby(['pathrow', 'window'], sort=False).head(k)
+    return scenes.loc[best.index.sort_values()]
+
+
+def searchProduct(productID, db_path, sat):
+    db_name = _get_catalog(sat, db_path)
+    conn = _connect(db_name)
+    output = pd.read_sql_query("SELECT * from raw_data WHERE (LANDSAT_PRODUCT_ID == ?)", conn, params=[productID])
+    conn.close()
+    return output
+
+
+def _product_files(folder, productID):
+    """ the files of a product in its (path/row shared) RAW_DATA folder """
+    try:
+        return [entry for entry in os.scandir(folder) if entry.name.startswith(productID) and entry.is_file()]
+    except OSError:
+        return []
+
+
+def _unshared_bytes(files):
+    """ bytes freed by removing files, hardlinks to data kept elsewhere free nothing """
+    return sum(st.st_size for st in (entry.stat() for entry in files) if st.st_nlink == 1)
+
+
+def register_scenes(db_name, productIDs, paths, sr='Y', bt='Y'):
+    """
+    Records where products are available on the local system by updating their rows in
+    place, so registering N scenes costs N indexed updates in one transaction rather
+    than a rewrite of the whole catalog. The bytes of the product files only the cache
+    holds are recorded and the products are marked as just used for evict_cache(), the
+    files update hardlinks from the user's own data are not charged against the quota.
+
+    :param db_name:     path to the catalog database
+    :param productIDs:  LANDSAT_PRODUCT_IDs of the products to register
+    :param paths:       local folder of each product, in the same order as productIDs
+    :param sr:          value of the sr availability flag, 'Y' or 'N'
+    :param bt:          value of the bt availability flag, 'Y' or 'N'
+    :return:            number of catalog rows updated
+    """
+    now = time()
+    rows = [(sr, bt, path, _unshared_bytes(_product_files(path, productID)), now, productID)
+            for productID, path in zip(productIDs, paths)]
+    conn = _connect(db_name)
+    try:
+        with _transaction(conn):
+            cur = conn.executemany("UPDATE raw_data SET sr = ?, bt = ?, local_file_path = ?, cache_bytes = ?, "
+                                   "last_access = ? WHERE LANDSAT_PRODUCT_ID = ?", rows)
+            nrows = cur.rowcount
+            _bump_catalog_version(conn)
+    finally:
+        conn.close()
+    return nrows
+
+
+def touch_scenes(db_name, productIDs, min_age=TOUCH_INTERVAL):
+    """
+    Marks cached products as just used, so evict_cache() removes them last. Call it when
+    products are handed to processing; registration marks them already and searches do
+    not, so reads never take the write lock. Products marked less than min_age seconds
+    ago are left alone, and the access time being only a hint for eviction, a catalog
+    that cannot be written (read-only, locked) is reported rather than raised.
+
+    :param db_name:     path to the catalog database
+    :param productIDs:  LANDSAT_PRODUCT_IDs of the products used
+    :param min_age:     seconds before the access time of a product is updated again
+    :return: number of products marked
+    """
+    now = time()
+    productIDs = list(productIDs)
+    try:
+        conn = _connect(db_name)
+        try:
+            stale = []
+            for i in range(0, len(productIDs), 500):
+                batch = productIDs[i:i + 500]
+                stale.extend(row[0] for row in conn.execute(
+                    "SELECT LANDSAT_PRODUCT_ID FROM raw_data WHERE LANDSAT_PRODUCT_ID IN ({0}) "
+                    "AND (last_access IS NULL OR last_access < ?)".format(", ".join("?" * len(batch))),
+                    batch + [now - min_age]))
+            if stale:
+                with _transaction(conn):
+                    conn.executemany("UPDATE raw_data SET last_access = ? WHERE LANDSAT_PRODUCT_ID = ?",
+                                     [(now, productID) for productID in stale])
+        finally:
             conn.close()
-        else:
-            conn = sqlite3.connect(db_name)
-            orig_df = pd.read_sql_query("SELECT * from raw_data", conn)
+    except sqlite3.Error as e:
+        logging.warning("Could not record the access to %d products: %s", len(productIDs), e)
+        return 0
+    return len(stale)
+
+
+def _parse_bytes(size):
+    """ parses a byte count such as 1073741824, '500G' or '1.5T' """
+    if size is None or isinstance(size, (int, float)):
+        return size
+    size = size.strip().upper().rstrip('B')
+    units = 'KMGTP'
+    if size and size[-1] in units:
+        return int(float(size[:-1]) * 1024 ** (units.index(size[-1]) + 1))
+    return int(size)
+
+
+def evict_cache(db_name, quota=CACHE_QUOTA, reserve=0, keep=()):
+    """
+    Removes the least recently used products from the local cache until the cached
+    products plus reserve bytes fit in the quota and reserve bytes are free on the
+    disk. Their sr/bt flags and local_file_path are reset in the catalog first, then
+    their files are removed, under an eviction lock. Only the files of the evicted
+    product are removed, as products of the same path/row share a RAW_DATA folder.
+    Products hardlinked from files kept elsewhere are never evicted, removing them would
+    free nothing and the next update would link them again.
+
+    :param db_name:     path to the catalog database
+    :param quota:       byte quota of the cache, e.g. 500 * 1024 ** 3 or '500G', None
+                        for no quota
+    :param reserve:     bytes about to be added to the cache, e.g. by a download
+    :param keep:        LANDSAT_PRODUCT_IDs never to evict, e.g. the ones being processed
+    :return: number of bytes freed
+    """
+    quota = _parse_bytes(quota)
+    keep = set(keep)
+    freed = 0
+    evicted = []
+    # one evictor at a time, two would both delete to cover the same need
+    with _catalog_lock(db_name, suffix='.evict.lock'):
+        conn = _connect(db_name)
+        try:
+            with _transaction(conn):
+                cached = conn.execute("SELECT LANDSAT_PRODUCT_ID, local_file_path, cache_bytes FROM raw_data "
+                                      "WHERE local_file_path != '' ORDER BY last_access").fetchall()
+                total = sum(nbytes or 0 for _, _, nbytes in cached)
+                need = total + reserve - quota if quota is not None else 0
+                if cached and os.path.exists(cached[0][1]):
+                    need = max(need, reserve - shutil.disk_usage(cached[0][1]).free)
+                for productID, folder, nbytes in cached:
+                    if freed >= need:
+                        break
+                    if productID in keep:
+                        continue
+                    # measured now, the original of a hardlinked product may be gone since
+                    nbytes = _unshared_bytes(_product_files(folder, productID))
+                    if not nbytes:
+                        continue
+                    freed += nbytes
+                    evicted.append((productID, folder))
+                if evicted:
+                    conn.executemany("UPDATE raw_data SET sr = 'N', bt = 'N', local_file_path = '', "
+                                     "cache_bytes = 0, last_access = NULL "
+                                     "WHERE LANDSAT_PRODUCT_ID = ? AND local_file_path = ?", evicted)
+                    _bump_catalog_version(conn)
+        finally:
             conn.close()
+        # the catalog no longer points at the files, a crash from here on leaves orphaned
+        # files behind rather than products flagged available without their files
+        for productID, folder in evicted:
+            for entry in _product_files(folder, productID):
+                os.remove(entry.path)
+    if need <= 0:
+        return 0
+    print("Evicted {0} products, {1:.1f} MB freed".format(len(evicted), freed / 1024. ** 2))
+    if freed < need:
+        print("Could only free {0:.1f} of the {1:.1f} MB needed".format(freed / 1024. ** 2, need / 1024. ** 2))
+    return freed
+
+
+def reserve_cache(db_name, nproducts, quota=CACHE_QUOTA, keep=()):
+    """
+    Makes room in the cache before downloading nproducts products, estimating their
+    size from the products already cached.
+
+    :param db_name:     path to the catalog database
+    :param nproducts:   number of products about to be downloaded
+    :param quota:       byte quota of the cache, see evict_cache()
+    :param keep:        LANDSAT_PRODUCT_IDs never to evict
+    :return: number of bytes freed
+    """
+    if nproducts == 0:
+        return 0
+    conn = _connect(db_name)
+    mean = conn.execute("SELECT AVG(cache_bytes) FROM raw_data WHERE local_file_path != '' "
+                        "AND cache_bytes > 0").fetchone()[0]
+    conn.close()
+    return evict_cache(db_name, quota, reserve=int(nproducts * (mean or PRODUCT_BYTES_ESTIMATE)), keep=keep)
+
+
+class CatalogSnapshot(object):
+    """
+    Columnar copy of the raw_data catalog for analytics-style filtering. Each column is
+    stored as a .npy file in a <db_name>.snapshot.* folder, named by <db_name>.snapshot.json,
+    and memory-mapped on load, so opening a snapshot copies nothing and point, bbox and
+    date filters run as vectorized NumPy masks over the whole catalog. The snapshot
+    records the catalog version it was built from and open() rebuilds it whenever the
+    catalog has changed since.
+    """
+
+    # column name -> (dtype, SQL expression it is built from)
+    COLUMNS = OrderedDict([
+        ('rowid', ('int64', "rowid")),
+        ('upperLeftCornerLatitude', ('float64', "upperLeftCornerLatitude")),
+        ('upperLeftCornerLongitude', ('float64', "upperLeftCornerLongitude")),
+        ('lowerRightCornerLatitude', ('float64', "lowerRightCornerLatitude")),
+        ('lowerRightCornerLongitude', ('float64', "lowerRightCornerLongitude")),
+        ('acquisitionDate', ('datetime64[D]', "acquisitionDate")),
+        ('cloudCover', ('float32', "cloudCover")),
+        ('sensor', ('int8', "sensor")),
+        ('available', ('bool', "sr = 'Y'")),
+        ('LANDSAT_PRODUCT_ID', ('S40', "LANDSAT_PRODUCT_ID")),
+    ])
+    SENSOR_CODES = {'OLI_TIRS': 0, 'OLI': 1, 'TIRS': 2, 'ETM': 3, 'TM': 4, 'MSS': 5}
+
+    def __init__(self, path, arrays, version):
+        self.path = path
+        self.arrays = arrays
+        self.version = version
+
+    def __len__(self):
+        return len(self.arrays['rowid'])
+
+    def __getitem__(self, column):
+        return self.arrays[column]
 
-        if (end.year > d.year) and (end.month > d.month) and (end.day > d.day):
-            conn = sqlite3.connect(db_name)
-            os.remove(fn)
-            wget.download(metadataUrl, out=fn)
-            metadata = pd.read_csv(fn, usecols=columns)
-            metadata['sr'] = pd.Series(np.tile('N', len(metadata)))
-            metadata['bt'] = pd.Series(np.tile('N', len(metadata)))
-            orig_df = pd.read_sql_query("SELECT * from raw_data", conn)
-            orig_df = orig_df.append(metadata, ignore_index=True)
-            orig_df = orig_df.drop_duplicates(subset='sceneID', keep='first')
-            orig_df.to_sql("raw_data", conn, if_exists="replace", index=False)
+    @staticmethod
+    def _pointer(db_name):
+        """ path of the file naming the current snapshot folder of a catalog """
+        return db_name + '.snapshot.json'
+
+    @classmethod
+    def _current(cls, db_name, version):
+        """ loads the current snapshot of a catalog if it was built from version, else None """
+        try:
+            with open(cls._pointer(db_name)) as f:
+                pointer = json.load(f)
+            if pointer['version'] != version:
+                return None
+            return cls.load(os.path.join(os.path.dirname(db_name), pointer['folder']))
+        except (OSError, ValueError, KeyError):
+            return None
+
+    @classmethod
+    def _write(cls, db_name, chunksize):
+        """ see build(), the caller holds the snapshot lock """
+        directory, base = os.path.split(db_name)
+        # a fresh folder per build, readers keep the folder the pointer named when they read it
+        path = tempfile.mkdtemp(prefix=base + '.snapshot.', dir=directory or '.')
+        conn = _connect(db_name)
+        try:
+            # one read transaction, the version and the rows come from the same state
+            conn.execute("BEGIN")
+            version = catalog_version(conn)
+            nrows = conn.execute("SELECT COUNT(*) FROM raw_data").fetchone()[0]
+            arrays = OrderedDict((name, np.lib.format.open_memmap(os.path.join(path, name + '.npy'), mode='w+',
+                                                                  dtype=dtype, shape=(nrows,)))
+                                 for name, (dtype, _) in cls.COLUMNS.items())
+            cur = conn.execute("SELECT {0} FROM raw_data".format(
+                ", ".join(expr for _, expr in cls.COLUMNS.values())))
+            start = 0
+            while True:
+                rows = cur.fetchmany(chunksize)
+                if not rows:
+                    break
+                columns = list(zip(*rows))
+                stop = start + len(rows)
+                for (name, (dtype, _)), values in zip(cls.COLUMNS.items(), columns):
+                    if name == 'sensor':
+                        values = [cls.SENSOR_CODES.get(v, -1) for v in values]
+                    elif name == 'acquisitionDate':
+                        values = [v if v else 'NaT' for v in values]
+                    elif name == 'LANDSAT_PRODUCT_ID':
+                        values = [v or '' for v in values]
+                    elif np.dtype(dtype).kind == 'f':
+                        values = [np.nan if v is None else v for v in values]
+                    arrays[name][start:stop] = np.asarray(values, dtype=dtype)
+                start = stop
+            for array in arrays.values():
+                array.flush()
+            del arrays
+            with open(os.path.join(path, 'meta.json'), 'w') as f:
+                json.dump({'version': version, 'rows': nrows}, f)
+        except Exception:
+            shutil.rmtree(path, ignore_errors=True)
+            raise
+        finally:
             conn.close()
-    else:
-        wget.download(metadataUrl, out=fn)
-        db_name = os.path.join(cacheDir, fn.split(os.sep)[-1][:-4] + '.db')
-        conn = sqlite3.connect(db_name)
-        orig_df = pd.read_csv(fn, usecols=columns)
-        orig_df['sr'] = pd.Series(np.tile('N', len(orig_df)))
-        orig_df['bt'] = pd.Series(np.tile('N', len(orig_df)))
-        orig_df['local_file_path'] = ''
-        orig_df.to_sql("raw_data", conn, if_exists="replace", index=False)
+
+        pointer = cls._pointer(db_name)
+        try:
+            with open(pointer) as f:
+                previous = json.load(f).get('folder')
+        except (OSError, ValueError):
+            previous = None
+        with open(pointer + '.part', 'w') as f:
+            json.dump({'folder': os.path.basename(path), 'version': version}, f)
+        os.replace(pointer + '.part', pointer)
+        # the previous folder stays for readers that just read the old pointer, older ones go
+        keep = (os.path.basename(path), previous)
+        for entry in os.scandir(directory or '.'):
+            if entry.name.startswith(base + '.snapshot') and entry.name not in keep and entry.is_dir():
+                shutil.rmtree(entry.path, ignore_errors=True)
+        return cls.load(path)
+
+    @classmethod
+    def build(cls, db_name, chunksize=CATALOG_CHUNKSIZE):
+        """
+        Writes the snapshot of a catalog, streaming the rows in chunks into memory-mapped
+        column files so the build itself has bounded memory. Each build writes a new
+        folder next to the catalog and then switches the pointer file to it, so readers
+        never find a half written or missing snapshot, and builds are serialized by a
+        snapshot lock.
+
+        :param db_name:     path to the catalog database
+        :param chunksize:   number of rows copied per batch
+        """
+        with _catalog_lock(db_name, suffix='.snapshot.lock'):
+            return cls._write(db_name, chunksize)
+
+    @classmethod
+    def load(cls, path):
+        """ memory-maps an existing snapshot folder """
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+        arrays = OrderedDict((name, np.load(os.path.join(path, name + '.npy'), mmap_mode='r'))
+                             for name in cls.COLUMNS)
+        return cls(path, arrays, meta['version'])
+
+    @classmethod
+    def open(cls, db_name, chunksize=CATALOG_CHUNKSIZE):
+        """
+        Returns the snapshot of a catalog, (re)building it first if it is missing or
+        older than the catalog. Processes finding it stale at the same time build it once.
+
+        :param db_name:     path to the catalog database
+        :param chunksize:   number of rows copied per batch when building
+        """
+        conn = _connect(db_name)
+        version = catalog_version(conn)
         conn.close()
+        snapshot = cls._current(db_name, version)
+        if snapshot is not None:
+            return snapshot
+        with _catalog_lock(db_name, suffix='.snapshot.lock'):
+            # another process may have built it while we waited for the lock
+            snapshot = cls._current(db_name, version)
+            if snapshot is None:
+                print("Building catalog snapshot of {0}".format(db_name))
+                snapshot = cls._write(db_name, chunksize)
+        return snapshot
+
+    def mask(self, lat=None, lon=None, bbox=None, start_date=None, end_date=None, cloud=None,
+             available=None, sensor=None):
+        """
+        Returns a boolean mask over the catalog rows matching all the given filters.
+
+        :param lat:         with lon, keep scenes whose corner box holds the point
+        :param lon:         see lat
+        :param bbox:        (minLon, minLat, maxLon, maxLat), keep scenes whose corner box
+                            intersects it
+        :param start_date:  keep scenes acquired on or after yyyy-mm-dd
+        :param end_date:    keep scenes acquired before yyyy-mm-dd
+        :param cloud:       maximum cloud cover
+        :param available:   'Y' or 'N' to keep scenes (not) on the local system
+        :param sensor:      sensor name, e.g. 'OLI_TIRS'
+        """
+        a = self.arrays
+        keep = np.ones(len(self), dtype=bool)
+        if lat is not None and lon is not None:
+            keep &= ((a['upperLeftCornerLatitude'] > lat) & (a['upperLeftCornerLongitude'] < lon) &
+                     (a['lowerRightCornerLatitude'] < lat) & (a['lowerRightCornerLongitude'] > lon))
+        if bbox is not None:
+            minLon, minLat, maxLon, maxLat = bbox
+            keep &= ((a['upperLeftCornerLatitude'] > minLat) & (a['lowerRightCornerLatitude'] < maxLat) &
+                     (a['upperLeftCornerLongitude'] < maxLon) & (a['lowerRightCornerLongitude'] > minLon))
+        if start_date is not None:
+            keep &= a['acquisitionDate'] >= np.datetime64(start_date, 'D')
+        if end_date is not None:
+            keep &= a['acquisitionDate'] < np.datetime64(end_date, 'D')
+        if cloud is not None:
+            keep &= a['cloudCover'] <= cloud
+        if available is not None:
+            keep &= a['available'] == (available == 'Y')
+        if sensor is not None:
+            keep &= a['sensor'] == self.SENSOR_CODES.get(sensor, -1)
+        return keep
+
+    def select(self, mask):
+        """ returns the snapshot columns of the masked rows as a DataFrame """
+        output = pd.DataFrame(OrderedDict((name, np.asarray(array[mask])) for name, array in self.arrays.items()))
+        output['LANDSAT_PRODUCT_ID'] = output.LANDSAT_PRODUCT_ID.str.decode('ascii')
+        return output
+
+
+def searchProducts(productIDs, db_path, sat):
+    """
+    Batched searchProduct(): looks up many products with a single query.
 
-    # ========updating database to reflect what is available on local system====
-    #    orig_df = pd.read_sql_query("SELECT * from raw_data",conn)
-    i = 0
-    for path in paths:
-        dbRows.loc[i, 'local_file_path'] = path
-        dbRows.loc[i, 'sr'] = 'Y'
-        dbRows.loc[i, 'bt'] = 'Y'
-        i += 1
-
-    conn = sqlite3.connect(db_name)
-    orig_df = orig_df.append(dbRows, ignore_index=True)
-    orig_df = orig_df.drop_duplicates(subset='sceneID', keep='last')
-    orig_df.to_sql("raw_data", conn, if_exists="replace", index=False)
+    :param productIDs:  LANDSAT_PRODUCT_IDs to look up
+    :param db_path:     directory holding the metadata CSV and catalog database
+    :param sat:         landsat satellite number, i.e. 7 or 8
+    :return: DataFrame of the catalog rows found
+    """
+    db_name = _get_catalog(sat, db_path)
+    conn = _connect(db_name)
+    conn.execute("CREATE TEMP TABLE wanted (productID TEXT PRIMARY KEY)")
+    conn.executemany("INSERT OR IGNORE INTO temp.wanted VALUES (?)", [(productID,) for productID in productIDs])
+    output = pd.read_sql_query("SELECT raw_data.* FROM temp.wanted "
+                               "CROSS JOIN raw_data ON raw_data.LANDSAT_PRODUCT_ID = wanted.productID", conn)
     conn.close()
+    return output
+
+
+class LocalSceneIndex(object):
+    """
+    Index of the Landsat product files found under local directory trees, kept in the
+    local_dirs and local_files tables of the catalog database. The tree is walked once,
+    with its top-level subdirectories walked in parallel, and the files are grouped by
+    the product ID their name starts with. Directories whose mtime has not changed since
+    the last update are not listed again, their files and subdirectories come from the
+    index.
+    """
+
+    def __init__(self, db_name, max_workers=8):
+        """
+        :param db_name:     path to the catalog database
+        :param max_workers: number of subdirectory trees walked in parallel
+        """
+        self.db_name = db_name
+        self.max_workers = max_workers
+        conn = _connect(db_name)
+        with _transaction(conn):
+            conn.execute("CREATE TABLE IF NOT EXISTS local_dirs (path TEXT PRIMARY KEY, mtime REAL, subdirs TEXT)")
+            conn.execute("CREATE TABLE IF NOT EXISTS local_files (dir TEXT, name TEXT, productID TEXT)")
+            conn.execute("CREATE INDEX IF NOT EXISTS local_files_dir_idx ON local_files (dir)")
+        conn.close()
+
+    @staticmethod
+    def _under(top):
+        """ returns the WHERE clause and parameters selecting top and the paths below it """
+        top = top.rstrip(os.sep)
+        return "(? = {0} OR ({0} >= ? AND {0} < ?))", [top, top + os.sep, top + chr(ord(os.sep) + 1)]
+
+    @staticmethod
+    def _scan_dir(path, known):
+        """
+        Returns (mtime, subdirs, files, changed) for a directory, only listing it if its
+        mtime differs from the indexed one. files is a list of (name, productID).
+        """
+        mtime = os.stat(path).st_mtime
+        entry = known.get(path)
+        if entry is not None and entry[0] == mtime:
+            return mtime, entry[1], None, False
+        subdirs = []
+        files = []
+        for entry in os.scandir(path):
+            if entry.is_dir(follow_symlinks=False):
+                subdirs.append(entry.name)
+            else:
+                match = PRODUCT_ID_PATTERN.match(entry.name)
+                if match:
+                    files.append((entry.name, match.group(1)))
+        return mtime, subdirs, files, True
+
+    def _scan_tree(self, root, known):
+        changed = {}
+        visited = []
+        stack = [root]
+        while stack:
+            path = stack.pop()
+            try:
+                mtime, subdirs, files, is_changed = self._scan_dir(path, known)
+            except OSError:
+                continue
+            visited.append(path)
+            if is_changed:
+                changed[path] = (mtime, subdirs, files)
+            stack.extend(os.path.join(path, subdir) for subdir in subdirs)
+        return changed, visited
+
+    def update(self, top):
+        """
+        Brings the index of a directory tree up to date.
+
+        :param top:     top directory of the tree
+        :return: number of directories that were (re)listed
+        """
+        top = os.path.abspath(top)
+        where, params = self._under(top)
+        conn = _connect(self.db_name)
+        known = dict((path, (mtime, json.loads(subdirs))) for path, mtime, subdirs in conn.execute(
+            "SELECT path, mtime, subdirs FROM local_dirs WHERE " + where.format('path'), params))
+        conn.close()
+
+        mtime, subdirs, files, is_changed = self._scan_dir(top, known)
+        changed = {top: (mtime, subdirs, files)} if is_changed else {}
+        visited = [top]
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            for tree_changed, tree_visited in pool.map(lambda root: self._scan_tree(root, known),
+                                                       [os.path.join(top, subdir) for subdir in subdirs]):
+                changed.update(tree_changed)
+                visited.extend(tree_visited)
+
+        removed = set(known) - set(visited)
+        conn = _connect(self.db_name)
+        with _transaction(conn):
+            for path in list(changed) + list(removed):
+                conn.execute("DELETE FROM local_files WHERE dir = ?", (path,))
+            conn.executemany("DELETE FROM local_dirs WHERE path = ?", [(path,) for path in removed])
+            for path, (mtime, subdirs, files) in changed.items():
+                conn.execute("INSERT OR REPLACE INTO local_dirs VALUES (?, ?, ?)", (path, mtime, json.dumps(subdirs)))
+                conn.executemany("INSERT INTO local_files VALUES (?, ?, ?)",
+                                 [(path, name, productID) for name, productID in files])
+        conn.close()
+        print("Indexed {0}: {1} directories listed, {2} unchanged".format(top, len(changed),
+                                                                          len(visited) - len(changed)))
+        return len(changed)
+
+    def products(self, top, prefix=None):
+        """
+        Returns the indexed product files under a directory tree grouped by product.
+
+        :param top:     top directory of the tree
+        :param prefix:  optional product ID prefix to keep, e.g. 'LC08'
+        :return: dict of product ID to the list of its file paths
+        """
+        where, params = self._under(os.path.abspath(top))
+        query = "SELECT dir, name, productID FROM local_files WHERE " + where.format('dir')
+        if prefix:
+            query += " AND substr(productID, 1, ?) = ?"
+            params += [len(prefix), prefix]
+        conn = _connect(self.db_name)
+        products = {}
+        for path, name, productID in conn.execute(query, params):
+            products.setdefault(productID, []).append(os.path.join(path, name))
+        conn.close()
+        return products
+
+
+def group_product_files(top):
+    """
+    Walks a directory tree and groups the product files found by the product ID their
+    name starts with. Unfinished downloads and extractions (.part) are left out.
+
+    :param top:     top directory of the tree
+    :return: dict of product ID to the list of its file paths
+    """
+    products = {}
+    for root, dirs, files in os.walk(top):
+        dirs[:] = [name for name in dirs if not name.endswith('.part')]
+        for name in files:
+            match = PRODUCT_ID_PATTERN.match(name)
+            if match and not name.endswith('.part'):
+                products.setdefault(match.group(1), []).append(os.path.join(root, name))
+    return products
+
+
+def _copy_file(source, dest, chunk_size=DOWNLOAD_CHUNK_SIZE):
+    """ chunked copy to a .part file renamed into place, so dest is never half written """
+    part = dest + '.part'
+    with open(source, 'rb') as fsrc, open(part, 'wb') as fdst:
+        shutil.copyfileobj(fsrc, fdst, chunk_size)
+    shutil.copystat(source, part)
+    os.replace(part, dest)
+
+
+def _place_file(source, dest, mode):
+    """
+    Puts a file in the cache without copying its data when source and dest are on the
+    same filesystem: 'move' renames it with os.replace, 'link' hardlinks it so the
+    original stays where it is. Falls back to a copy across devices, or when the
+    filesystem does not support hardlinks.
+    """
+    if os.path.exists(dest):
+        return False
+    try:
+        if mode == 'move':
+            os.replace(source, dest)
+        else:
+            os.link(source, dest)
+        return True
+    except OSError as e:
+        if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK, errno.ENOTSUP):
+            raise
+    _copy_file(source, dest)
+    if mode == 'move':
+        os.remove(source)
+    return True
+
+
+def ingest_products(products, cacheDir, sat, mode='move', max_workers=8):
+    """
+    Places product files in the SATELLITE_DATA/LANDSAT/L<sat>/<scene>/RAW_DATA cache,
+    matching files to scenes by the product ID rather than by folder position. Files are
+    renamed or hardlinked when the cache is on the same filesystem, only files crossing
+    devices are copied, in parallel and in chunks.
+
+    :param products:    dict of product ID to the list of its file paths
+    :param cacheDir:    directory of the Landsat cache
+    :param sat:         landsat satellite number, i.e. 7 or 8
+    :param mode:        'move' to take the files (downloads) or 'link' to leave the
+                        originals in place (existing user data)
+    :param max_workers: number of files placed in parallel
+    :return: dict of product ID to its RAW_DATA folder
+    """
+    folders = {}
+    jobs = []
+    for productID, filenames in products.items():
+        scene = productID.split('_')[2]
+        folder = os.path.join(cacheDir, "L%d" % sat, scene, "RAW_DATA")
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+        folders[productID] = folder
+        jobs.extend((filename, os.path.join(folder, os.path.basename(filename))) for filename in filenames)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        placed = sum(pool.map(lambda job: _place_file(job[0], job[1], mode), jobs))
+    print("Ingested {0} products: {1} files placed, {2} already cached".format(len(folders), placed,
+                                                                             len(jobs) - placed))
+    return folders
+
+
+def updateDB(dbRows, paths, cacheDir, sat):
+    end = datetime.strptime(str(dbRows.acquisitionDate.values[0]), '%Y-%m-%d')
+    db_name = _get_catalog(sat, cacheDir, end)
+    # ========updating database to reflect what is available on local system====
+    register_scenes(db_name, dbRows.LANDSAT_PRODUCT_ID.values, paths)
 
 
-def download_order_gen(order_id, auth, downloader=None, sleep_time=300, timeout=86400, **dlkwargs):
+def download_order_gen(order_id, auth, downloader=None, sleep_time=300, timeout=86400, pipeline=False,
+                       **dlkwargs):
     """
     This function is a generator that yields the results from the input downloader classes
     download() method. This is a generator mostly so that data pipeline functions that operate
@@ -398,9 +2095,12 @@ def download_order_gen(order_id, auth, downloader=None, sleep_time=300, timeout=
 
     :param order_id:            order name
     :param downloader:          optional downloader for tiles. child of BaseDownloader class
-                                of a Downloaders.BaseDownloader or child class
+                                of a Downloaders.BaseDownloader or child class, the complete
+                                items of each status check are downloaded concurrently
     :param sleep_time:          number of seconds to wait between checking order status
     :param timeout:             maximum number of seconds to run program
+    :param pipeline:            use True to extract archives in a process pool while the next
+                                downloads run, see BaseDownloader.pipeline_queue()
     :param dlkwargs:            keyword arguments for downloader.download() method.
     :returns:                   yields values from the input downloader.download() method.
     """
@@ -408,6 +2108,7 @@ def download_order_gen(order_id, auth, downloader=None, sleep_time=300, timeout=
     complete = False
     reached_timeout = False
     starttime = datetime.now()
+    wait = sleep_time
 
     if downloader is None:
         downloader = BaseDownloader('espa_downloads')
@@ -419,173 +2120,698 @@ def download_order_gen(order_id, auth, downloader=None, sleep_time=300, timeout=
         print("Elapsed time is {0}m".format(elapsed_time / 60.0))
 
         # check order completion status, and list all items which ARE complete
-        #            complete_items = self._complete_items(order_id, verbose=False)
-
-        filters = {"status": "complete"}  # Here, we ignore any purged orders
-        complete_items = espa_api('item-status/{0}'.format(order_id), uauth=auth, body=filters)[order_id]
-        for c in complete_items:
-            if isinstance(c, dict):
-                url = c["product_dload_url"]
-            elif isinstance(c, requests.Request):
-                url = c.json()["product_dload_url"]
-            else:
-                raise Exception("Could not interpret {0}".format(c))
-            yield downloader.download(url, **dlkwargs)
         resp = espa_api('item-status/{0}'.format(order_id), uauth=auth)
-        all_items = resp[order_id]
+        all_items = resp.get(order_id) if isinstance(resp, dict) else None
+        if all_items is None:
+            # a failed check says nothing about the items, back off to at most 4 * sleep_time
+            wait = min(wait * 2, 4 * sleep_time)
+            print("Could not check order {0}, next check in {1:.0f}s".format(order_id, wait))
+            sleep(wait)
+            continue
+        wait = sleep_time
+
+        for c in all_items:
+            if isinstance(c, requests.Request):
+                c = c.json()
+            if not isinstance(c, dict):
+                raise Exception("Could not interpret {0}".format(c))
+            if c.get('status') == 'complete' and c.get('product_dload_url'):
+                downloader.enqueue(c["product_dload_url"], checksum_url=c.get("cksum_download_url") or None,
+                                   **dlkwargs)
+        for result in downloader.pipeline_queue() if pipeline else downloader.download_queue():
+            yield result
 
-        active_items = [item for item in all_items
-                        if item['status'] != 'complete' and
-                        item['status'] != 'error' and
-                        item['status'] != 'unavailable' and
-                        item['status'] != 'purged']
+        active_items = [item for item in all_items if item.get('status') not in ORDER_FINAL_STATUSES]
 
         complete = (len(active_items) < 1)
         if not complete:
             sleep(sleep_time)
 
 
-def get_landsat_data(sceneIDs, auth):
-    username = auth[0]
-    password = auth[1]
+class OrderPoller(object):
+    """
+    Tracks the item status of many ESPA orders at once. Each order is polled by its
+    own asyncio task on an interval that adapts to the status of its pending items:
+    items being processed are checked often, items still queued or on order rarely,
+    and an order that makes no progress between two checks backs off geometrically up
+    to max_interval. Items are handed to a callback the moment they reach 'complete'.
+    """
+
+    def __init__(self, auth, min_interval=30, max_interval=900, backoff=1.5, timeout=TIMEOUT):
+        """
+        :param auth:            tuple(usgs username, usgs password)
+        :param min_interval:    shortest wait in seconds between two checks of an order
+        :param max_interval:    longest wait in seconds between two checks of an order
+        :param backoff:         factor applied to the wait when an order made no progress
+        :param timeout:         maximum number of seconds to track an order
+        """
+        self.auth = auth
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.timeout = timeout
+        self.orders = {}
+
+    def watch(self, orderid, names=None):
+        """
+        Adds an order to track.
+
+        :param orderid:     ESPA order id
+        :param names:       optional item names (product IDs) to track, all items if None
+        """
+        if names is None or orderid not in self.orders or self.orders[orderid] is None:
+            self.orders[orderid] = None if names is None else set(names)
+        else:
+            self.orders[orderid].update(names)
+
+    def _next_interval(self, interval, statuses, progressed):
+        target = min(ORDER_POLL_INTERVALS.get(status, self.max_interval) for status in statuses)
+        if not progressed:
+            target = max(target, interval * self.backoff)
+        return min(max(target, self.min_interval), self.max_interval)
+
+    async def _poll_order(self, orderid, names, on_complete):
+        loop = asyncio.get_event_loop()
+        starttime = time()
+        interval = self.min_interval
+        handed = set()
+        last_statuses = None
+        while True:
+            try:
+                resp = await loop.run_in_executor(None, espa_api, 'item-status/{0}'.format(orderid), 'get', None,
+                                                  self.auth)
+            except Exception as e:
+                print("Checking order {0} failed: {1}".format(orderid, e))
+                resp = None
+            items = resp.get(orderid) if isinstance(resp, dict) else None
+            if items is None:
+                # a failed check says nothing about the items, keep them pending and back off
+                statuses = last_statuses
+                interval = min(max(interval * self.backoff, self.min_interval), self.max_interval)
+                print("Could not check order {0}, next check in {1:.0f}s".format(orderid, interval))
+            else:
+                if names is not None:
+                    items = [item for item in items if item.get('name') in names]
+                pending = []
+                for item in items:
+                    status = item.get('status')
+                    if status == 'complete' and item.get('product_dload_url'):
+                        if item['name'] not in handed:
+                            handed.add(item['name'])
+                            on_complete(orderid, item)
+                    elif status not in ORDER_FINAL_STATUSES:
+                        pending.append(status)
+                if not pending:
+                    return
+                statuses = sorted(pending)
+                interval = self._next_interval(interval, statuses, statuses != last_statuses)
+                print("Order {0}: {1} items pending, next check in {2:.0f}s".format(orderid, len(pending),
+                                                                                  interval))
+            last_statuses = statuses
+            elapsed_time = time() - starttime
+            if elapsed_time > self.timeout:
+                print("Gave up on order {0} after {1}m".format(orderid, elapsed_time / 60.0))
+                return
+            await asyncio.sleep(interval)
+
+    async def run(self, on_complete):
+        """
+        Polls all watched orders until every tracked item is final or timed out.
+
+        :param on_complete: callable(orderid, item) called once for each complete item
+        :raises Exception:  once all orders are done, if polling any of them failed
+        """
+        errors = []
+
+        async def poll(orderid, names):
+            # an error in one order must not stop the polling of the others
+            try:
+                await self._poll_order(orderid, names, on_complete)
+            except Exception as e:
+                print("Polling order {0} failed: {1}".format(orderid, e))
+                errors.append((orderid, e))
+
+        await asyncio.gather(*[poll(orderid, names) for orderid, names in self.orders.items()])
+        if errors:
+            raise Exception("Polling failed for orders: {0}".format(
+                ", ".join(orderid for orderid, _ in errors))) from errors[0][1]
+
+
+def download_orders(orders, auth, downloader=None, poller_kwargs=None, pipeline=False, **dlkwargs):
+    """
+    Generator that polls many ESPA orders concurrently with an OrderPoller and starts
+    downloading each item as soon as it is complete, so one slow order never holds up
+    the others. Yields the downloader.download() results as the downloads finish. A
+    failed download or order does not stop the others, the failures are raised once
+    every other item is downloaded.
+
+    :param orders:          dict of order id to the item names to get from it, or None
+                            for all of its items
+    :param auth:            tuple(usgs username, usgs password)
+    :param downloader:      optional BaseDownloader, its pool settings bound the downloads
+    :param poller_kwargs:   optional keyword arguments for the OrderPoller
+    :param pipeline:        use True to extract the archives in the downloader's process
+                            pool of extract_workers while the next downloads run, as
+                            BaseDownloader.pipeline_queue() does. With stream=True the
+                            archives are extracted while downloading instead
+    :param dlkwargs:        keyword arguments for downloader.download() method.
+    :returns:               yields values from the input downloader.download() method.
+    """
+    if downloader is None:
+        downloader = BaseDownloader('espa_downloads')
+    poller = OrderPoller(auth, **(poller_kwargs or {}))
+    for orderid, names in orders.items():
+        poller.watch(orderid, names)
+
+    results = Queue()
+    submitted = {}
+    polling_done = object()
+    poll_errors = []
+    download_errors = []
+    extract_pool = downloader.extract_pool() if pipeline else None
+
+    def staged(pool, source, kwargs):
+        """ downloads in the thread pool, then extracts in the process pool, as one future """
+        kwargs = dict(kwargs)
+        kwargs.pop('stream', None)
+        ext_dest = downloader._ext_destination_mapper(downloader._raw_destination_mapper(source))
+        extkwargs = {'delete_originals': kwargs.get('cleanup', True),
+                     'include': kwargs.pop('include', None),
+                     'exclude': kwargs.pop('exclude', None)}
+        item = Future()
+
+        def extracted(future):
+            try:
+                future.result()
+                item.set_result((ext_dest, True))
+            except Exception as e:
+                item.set_exception(e)
+
+        def fetched(future):
+            try:
+                raw_dest = future.result()
+                if raw_dest is None:
+                    item.set_result((ext_dest, False))
+                else:
+                    extract_pool.submit(extract_archive, raw_dest, ext_dest, **extkwargs).add_done_callback(
+                        extracted)
+            except Exception as e:
+                item.set_exception(e)
+
+        pool.submit(downloader._pipeline_fetch, source, **kwargs).add_done_callback(fetched)
+        return item
+
+    try:
+        with ThreadPoolExecutor(max_workers=downloader.max_workers) as pool:
+            def on_complete(orderid, item):
+                kwargs = dict(dlkwargs, checksum_url=item.get('cksum_download_url') or None)
+                if pipeline and not kwargs.get('stream'):
+                    future = staged(pool, item['product_dload_url'], kwargs)
+                else:
+                    future = pool.submit(downloader._pooled_download, item['product_dload_url'], kwargs)
+                submitted[future] = item['product_dload_url']
+                future.add_done_callback(results.put)
+
+            def poll():
+                try:
+                    asyncio.run(poller.run(on_complete))
+                except BaseException as e:
+                    poll_errors.append(e)
+                finally:
+                    results.put(polling_done)
+
+            poll_thread = threading.Thread(target=poll)
+            poll_thread.daemon = True
+            poll_thread.start()
+            finished = 0
+            polling = True
+            while polling or finished < len(submitted):
+                result = results.get()
+                if result is polling_done:
+                    polling = False
+                    continue
+                finished += 1
+                try:
+                    download = result.result()
+                except Exception as e:
+                    download_errors.append((submitted[result], e))
+                    continue
+                yield download
+            poll_thread.join()
+    finally:
+        if extract_pool is not None:
+            extract_pool.shutdown()
+    if poll_errors:
+        # the items already handed off are downloaded, the scenes of the failed orders are not
+        for source, e in download_errors:
+            print("Could not download {0}: {1}".format(source, e))
+        raise poll_errors[0]
+    _raise_download_errors(download_errors, len(submitted))
+
+
+class OrderPlanner(object):
+    """
+    Places ESPA orders for a list of scenes. The scenes are split into orders of at
+    most batch_size, which are submitted concurrently. Before ordering, the scenes are
+    claimed in the inflight table of the order cache database inside an IMMEDIATE
+    transaction, and the order id is recorded there once the order is placed, so runs
+    sharing the database reuse each other's in-flight orders instead of ordering the
+    same scenes twice.
+    """
+
+    def __init__(self, auth, cache_db=None, batch_size=ORDER_BATCH_SIZE, max_workers=4, products=('sr', 'bt'),
+                 claim_timeout=ORDER_CLAIM_TIMEOUT):
+        """
+        :param auth:            tuple(usgs username, usgs password)
+        :param cache_db:        optional path to the order cache database shared between runs
+        :param batch_size:      maximum number of scenes per order
+        :param max_workers:     number of orders submitted concurrently
+        :param products:        ESPA products to order for every scene
+        :param claim_timeout:   seconds after which a claim or an unlisted order is considered
+                                abandoned and its scenes are ordered again
+        """
+        self.auth = auth
+        self.batch_size = batch_size
+        self.max_workers = max_workers
+        self.products = list(products)
+        self.claim_timeout = claim_timeout
+        self.conn = _open_order_cache(cache_db or ':memory:')
+        self.conn.execute("CREATE TABLE IF NOT EXISTS inflight (productID TEXT PRIMARY KEY, orderid TEXT, "
+                          "claimed REAL)")
+        self.conn.commit()
+        # transactions are managed explicitly, see claim()
+        self.conn.isolation_level = None
+
+    def claim(self, productIDs, listed_items=None):
+        """
+        Splits scenes into those already ordered by a run sharing the database and those
+        this run has to order, which it claims. Scenes another run is ordering right now
+        are waited for. An in-flight order is only reused while ESPA lists its item for the
+        scene as complete or still in progress: a scene whose item failed or was purged
+        is claimed and ordered again.
+
+        :param productIDs:      LANDSAT_PRODUCT_IDs of the scenes to order
+        :param listed_items:    dict of (order id, product ID) to the item status of the
+                                orders ESPA currently lists for the user
+        :return: tuple(dict of reused order id to product IDs, list of product IDs to order)
+        """
+        listed_items = listed_items or {}
+        listed_orders = set(orderid for orderid, _ in listed_items)
+        reused = {}
+        to_order = []
+        pending = list(productIDs)
+        while pending:
+            waiting = []
+            now = time()
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                claims = {}
+                for i in range(0, len(pending), 500):
+                    batch = pending[i:i + 500]
+                    claims.update((row[0], row[1:]) for row in self.conn.execute(
+                        "SELECT productID, orderid, claimed FROM inflight WHERE productID IN ({0})".format(
+                            ", ".join("?" * len(batch))), batch))
+                mine = []
+                for productID in pending:
+                    orderid, claimed = claims.get(productID, (None, None))
+                    recent = claimed is not None and now - claimed < self.claim_timeout
+                    status = listed_items.get((orderid, productID))
+                    usable = status == 'complete' or (status is not None and status not in ORDER_FINAL_STATUSES)
+                    # orders placed moments ago may not be listed yet
+                    if orderid is not None and (usable or (orderid not in listed_orders and recent)):
+                        reused.setdefault(orderid, set()).add(productID)
+                    elif orderid is None and recent:
+                        waiting.append(productID)
+                    else:
+                        # replaces the mapping to a failed or abandoned order
+                        mine.append(productID)
+                self.conn.executemany("INSERT OR REPLACE INTO inflight VALUES (?, NULL, ?)",
+                                      [(productID, now) for productID in mine])
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+            to_order.extend(mine)
+            pending = waiting
+            if pending:
+                print("Waiting for another run to order {0} scenes".format(len(pending)))
+                sleep(ORDER_CLAIM_POLL)
+        return reused, to_order
+
+    def _release(self, productIDs):
+        self.conn.executemany("DELETE FROM inflight WHERE productID = ? AND orderid IS NULL",
+                              [(productID,) for productID in productIDs])
+
+    def _submit(self, productIDs):
+        """ places one order, returns its order id """
+        order = espa_api('available-products', uauth=self.auth, body=dict(inputs=list(productIDs)))
+        if order is None:
+            raise Exception("Could not list the available products")
+        for sensor in order.keys():
+            if isinstance(order[sensor], dict) and order[sensor].get('inputs'):
+                order[sensor]['products'] = self.products
+
+        order['format'] = 'gtiff'
+        # =======order the data============
+        resp = espa_api('order', verb='post', uauth=self.auth, body=order)
+        if resp is None:
+            raise Exception("Could not place the order")
+        print(json.dumps(resp, indent=4))
+        return resp['orderid']
 
-    #    client = Client(auth)
-    def api_request(endpoint, verb='get', json=None, uauth=None):
+    def submit(self, productIDs, listed_items=None):
         """
-        Here we can see how easy it is to handle calls to a REST API that uses JSON
+        Orders the scenes not already in flight, in concurrently submitted batches.
+
+        :param productIDs:      LANDSAT_PRODUCT_IDs of the scenes to order
+        :param listed_items:    dict of (order id, product ID) to the item status of the
+                                orders ESPA currently lists for the user, see claim()
+        :return: dict of order id to the product IDs to get from it, reused orders included
         """
-        auth_tup = uauth if uauth else (username, password)
-        response = getattr(requests, verb)(host + endpoint, auth=auth_tup, json=json)
-        return response.json()
+        orders, to_order = self.claim(productIDs, listed_items)
+        if orders:
+            print("Reusing {0} orders in flight".format(len(orders)))
+        batches = [to_order[i:i + self.batch_size] for i in range(0, len(to_order), self.batch_size)]
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            futures = dict((pool.submit(self._submit, batch), batch) for batch in batches)
+            for future in as_completed(futures):
+                batch = futures[future]
+                try:
+                    orderid = future.result()
+                except Exception as e:
+                    print("Ordering {0} scenes failed: {1}".format(len(batch), e))
+                    self._release(batch)
+                    continue
+                self.conn.executemany("UPDATE inflight SET orderid = ? WHERE productID = ?",
+                                      [(orderid, productID) for productID in batch])
+                orders[orderid] = set(batch)
+        return orders
+
+    def close(self):
+        self.conn.close()
 
+
+def get_landsat_data(sceneIDs, auth, cacheDir=None, pipeline=False, **dlkwargs):
+    """
+    Orders the scenes that are not yet ordered from ESPA and downloads them, along with
+    those already sitting in existing orders.
+
+    :param sceneIDs:    LANDSAT_PRODUCT_IDs of the scenes to get
+    :param auth:        tuple(usgs username, usgs password)
+    :param cacheDir:    optional directory to keep the local ESPA order cache in
+    :param pipeline:    use True to extract archives in a process pool while the next
+                        downloads run, see download_orders()
+    :param dlkwargs:    keyword arguments for BaseDownloader.download(), e.g. include=[...]
+                        to only extract some of the bands
+    """
     # =====set products=======
     l8_prods = ['sr', 'bt']
     # =====search for data=======
     print("Searching...")
-    ordered_data = check_order_cache(auth)
+    cache_db = os.path.join(cacheDir, ORDER_CACHE_DB) if cacheDir else None
+    ordered_data = check_order_cache(auth, cache_db=cache_db)
     l8_tiles = []
     orderedIDs_completed = []
     orderedIDs_not_completed = []
     sceneIDs_completed = []
     sceneIDs_not_completed = []
+    # index the order inventory by product ID in one pass, so matching is a dict lookup per
+    # scene. Items that failed or were purged count as not ordered and are ordered again.
+    completed_orders = {}
+    pending_orders = {}
+    for orderid, productID, status in zip(ordered_data.orderid, ordered_data.productID, ordered_data.status):
+        if status == 'complete':
+            completed_orders.setdefault(productID, orderid)
+        elif status not in ORDER_FINAL_STATUSES:
+            pending_orders.setdefault(productID, orderid)
     for sceneID in sceneIDs:
-        if not ordered_data.empty:
-            if np.sum(ordered_data.productID == sceneID) > 0:
-                completed_test = (ordered_data.productID == sceneID) & (ordered_data.status == 'complete')
-                not_complete_test = (ordered_data.productID == sceneID) & (ordered_data.status != 'complete')
-                if len(ordered_data[completed_test]) > 0:
-                    orderedIDs_completed.append(list(ordered_data.orderid[completed_test])[0])
-                    sceneIDs_completed.append(sceneID)
-                else:
-                    orderedIDs_not_completed.append(list(ordered_data.orderid[not_complete_test])[0])
-                    sceneIDs_not_completed.append(sceneID)
-            else:
-                l8_tiles.append(sceneID)
+        if sceneID in completed_orders:
+            orderedIDs_completed.append(completed_orders[sceneID])
+            sceneIDs_completed.append(sceneID)
+        elif sceneID in pending_orders:
+            orderedIDs_not_completed.append(pending_orders[sceneID])
+            sceneIDs_not_completed.append(sceneID)
         else:
             l8_tiles.append(sceneID)
 
     if l8_tiles:
         print("Ordering new data...")
-        # ========setup order=========
-        order = espa_api('available-products', uauth=auth, body=dict(inputs=l8_tiles))
-        for sensor in order.keys():
-            if isinstance(order[sensor], dict) and order[sensor].get('inputs'):
-                order[sensor]['products'] = l8_prods
+        # ========setup and place the orders, reusing orders other runs have in flight======
+        planner = OrderPlanner(auth, cache_db=cache_db, products=l8_prods)
+        listed_items = dict(((orderid, productID), status) for orderid, productID, status
+                            in zip(ordered_data.orderid, ordered_data.productID, ordered_data.status))
+        new_orders = planner.submit(l8_tiles, listed_items=listed_items)
+        planner.close()
+    else:
+        new_orders = {}
+
+    # ======Download data=========
+    # existing and new orders are polled together, each item downloads as soon as it is ready
+    orders = {}
+    for orderid, sceneID in zip(orderedIDs_completed + orderedIDs_not_completed,
+                                sceneIDs_completed + sceneIDs_not_completed):
+        orders.setdefault(orderid, set()).add(sceneID)
+    for orderid, names in new_orders.items():
+        orders.setdefault(orderid, set()).update(names)
+    if orders:
+        print("Downloading from {0} orders...".format(len(orders)))
+        for download in download_orders(orders, auth, pipeline=pipeline, **dlkwargs):
+            print(download)
+    get_espa_client(auth).report()
 
-        order['format'] = 'gtiff'
-        # =======order the data============
-        resp = espa_api('order', verb='post', uauth=auth, body=order)
-        print(json.dumps(resp, indent=4))
-        orderidNew = resp['orderid']
-
-    if orderedIDs_completed:
-
-        print("downloading completed existing orders...")
-        print(orderedIDs_completed)
-        i = -1
-        for orderid in orderedIDs_completed:
-            i += 1
-            sceneID = sceneIDs_completed[i]
-            complete = False
-            reached_TIMEOUT = False
-            starttime = datetime.now()
-            while not complete and not reached_TIMEOUT:
-                resp = espa_api('item-status/{0}'.format(orderid), uauth=auth)
-                for item in resp[orderid]:
-                    if item.get('name') == sceneID:
-                        url = item.get('product_dload_url')
-                        elapsed_time = (datetime.now() - starttime).seconds
-                        reached_TIMEOUT = elapsed_time > TIMEOUT
-                        print("Elapsed time is {0}m".format(elapsed_time / 60.0))
-                        if len(url) > 0:
-                            downloader = BaseDownloader('espa_downloads')
-                            downloader.download(url)
-                            # if os.path.exists(os.path.join(os.getcwd,'espa_downloads',url.split(os.sep)[-1][:-7])):
-                            complete = True
-
-                        if not complete:
-                            sleep(300)
-
-    if orderedIDs_not_completed:
-        print("waiting for cached existing orders...")
-        i = -1
-        for orderid in orderedIDs_not_completed:
-            i += 1
-            complete = False
-            reached_TIMEOUT = False
-            starttime = datetime.now()
-            sceneID = sceneIDs_not_completed[i]
-            while not complete and not reached_TIMEOUT:
-                resp = api_request('item-status/{0}'.format(orderid))
-                for item in resp[orderid]:
-                    if item.get('name') == sceneID:
-                        url = item.get('product_dload_url')
-                        elapsed_time = (datetime.now() - starttime).seconds
-                        reached_TIMEOUT = elapsed_time > TIMEOUT
-                        print("Elapsed time is {0}m".format(elapsed_time / 60.0))
-                        if len(url) > 0:
-                            downloader = BaseDownloader('espa_downloads')
-                            downloader.download(url)
-                            # if os.path.exists(os.path.join(os.getcwd,'espa_downloads',url.split(os.sep)[-1][:-7])):
-                            complete = True
-
-                        if not complete:
-                            sleep(300)
 
-    if l8_tiles:
-        print("Download new data...")
-        # ======Download data=========
-        for download in download_order_gen(orderidNew, auth):
-            print(download)
+class CatalogService(object):
+    """
+    Long-running catalog query service. It keeps a pool of open read connections to the
+    catalog databases and an LRU cache of query results in memory, and serves search
+    and availability queries over HTTP on localhost, so schedulers running thousands of
+    searches a day do not pay for the interpreter, pandas and catalog startup on each
+    one. Cached results are keyed on the catalog version, so scenes registered or
+    evicted by any process are seen by the next query. Queries never touch the network,
+    the bulk metadata is refreshed by a background thread every
+    METADATA_REFRESH_INTERVAL seconds. The address of the running service is written to
+    SERVICE_FILE in the cache directory, where service_request() finds it.
+
+    Endpoints (GET, JSON):
+        /search?lat=&lon=&start_date=&end_date=&cloud=&available=&sat=
+        /available?sat=&productID=...&productID=...
+        /status
+    """
 
+    def __init__(self, cacheDir, host='127.0.0.1', port=0, cache_size=SERVICE_CACHE_SIZE):
+        """
+        :param cacheDir:    directory of the Landsat cache the CLI uses
+        :param host:        address to listen on, keep it local, there is no authentication
+        :param port:        port to listen on, 0 picks a free one
+        :param cache_size:  number of query results kept in the LRU cache
+        """
+        self.cacheDir = cacheDir
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.catalogs = {}
+        self.catalogs_lock = threading.Lock()
+        self.readers = {}
+        self.stopped = threading.Event()
+        self.server = ThreadingHTTPServer((host, port), _CatalogRequestHandler)
+        self.server.daemon_threads = True
+        self.server.service = self
+        self.path = os.path.join(cacheDir, SERVICE_FILE)
+
+    def _catalog(self, sat):
+        # one thread builds a missing catalog, the catalog lock only excludes other processes
+        with self.catalogs_lock:
+            if sat not in self.catalogs:
+                self.catalogs[sat] = _get_catalog(sat, self.cacheDir)
+            return self.catalogs[sat]
+
+    @contextmanager
+    def _reader(self, sat):
+        """ a read connection to the catalog of sat, borrowed from the pool for one query """
+        db_name = self._catalog(sat)
+        with self.lock:
+            pool = self.readers.setdefault(sat, [])
+            conn = pool.pop() if pool else None
+        if conn is None:
+            conn = _connect(db_name, check_same_thread=False)
+        try:
+            yield conn
+        finally:
+            with self.lock:
+                self.readers[sat].append(conn)
+
+    def refresh(self):
+        """ brings the metadata of the catalogs in use up to date, see _get_catalog() """
+        with self.catalogs_lock:
+            sats = list(self.catalogs)
+        for sat in sats:
+            try:
+                _get_catalog(sat, self.cacheDir, datetime.now())
+            except Exception as e:
+                logging.warning("Could not refresh the Landsat %d catalog: %s", sat, e)
+
+    def _refresh_loop(self):
+        while not self.stopped.wait(METADATA_REFRESH_INTERVAL):
+            self.refresh()
+
+    def _cached(self, key, compute):
+        """ returns tuple(value, hit) """
+        with self.lock:
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                self.hits += 1
+                return self.cache[key], True
+            self.misses += 1
+        value = compute()
+        with self.lock:
+            self.cache[key] = value
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return value, False
+
+    def query(self, endpoint, params):
+        """ answers a query, params maps each parameter to its list of values """
+        if endpoint == 'status':
+            with self.lock:
+                return dict(pid=os.getpid(), cached=len(self.cache), hits=self.hits, misses=self.misses)
+        sat = int(params.get('sat', ['8'])[0])
+        if endpoint == 'search':
+            args = (float(params['lat'][0]), float(params['lon'][0]), params['start_date'][0],
+                    params['end_date'][0], float(params['cloud'][0]), params.get('available', ['N'])[0])
+            with self._reader(sat) as conn:
+                key = ('search', sat, args, catalog_version(conn))
+                return self._cached(key, lambda: _cursor_rows(conn.execute(*_search_query(*args, sat=sat))))[0]
+        if endpoint == 'available':
+            productIDs = tuple(sorted(params.get('productID', [])))
+
+            def available():
+                rows = dict(columns=['LANDSAT_PRODUCT_ID', 'sr', 'bt', 'local_file_path'], data=[])
+                for i in range(0, len(productIDs), 500):
+                    batch = productIDs[i:i + 500]
+                    rows['data'].extend(conn.execute(
+                        "SELECT LANDSAT_PRODUCT_ID, sr, bt, local_file_path FROM raw_data "
+                        "WHERE LANDSAT_PRODUCT_ID IN ({0})".format(", ".join("?" * len(batch))), batch))
+                return rows
+
+            with self._reader(sat) as conn:
+                key = ('available', sat, productIDs, catalog_version(conn))
+                return self._cached(key, available)[0]
+        raise KeyError(endpoint)
+
+    def serve_forever(self):
+        host, port = self.server.server_address[:2]
+        with open(self.path, 'w') as f:
+            json.dump(dict(host=host, port=port, pid=os.getpid()), f)
+        print("Serving the catalog of {0} on http://{1}:{2}/".format(self.cacheDir, host, port))
+        refresher = threading.Thread(target=self._refresh_loop)
+        refresher.daemon = True
+        refresher.start()
+        try:
+            self.server.serve_forever()
+        finally:
+            self.stopped.set()
+            self.server.server_close()
+            with self.lock:
+                for pool in self.readers.values():
+                    for conn in pool:
+                        conn.close()
+                self.readers.clear()
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+    def shutdown(self):
+        self.stopped.set()
+        self.server.shutdown()
+
+
+class _CatalogRequestHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        try:
+            body = self.server.service.query(url.path.strip('/'), parse_qs(url.query))
+            code = 200
+        except KeyError as e:
+            body, code = dict(error='missing parameter or unknown endpoint: %s' % e), 400
+        except Exception as e:
+            body, code = dict(error=str(e)), 500
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
 
-def main():
-    # Get time and location from user
-    parser = argparse.ArgumentParser()
-    parser.add_argument("lat", type=float, help="latitude")
-    parser.add_argument("lon", type=float, help="longitude")
-    parser.add_argument("start_date", type=str, help="Start date yyyy-mm-dd")
-    parser.add_argument("end_date", type=str, help="Start date yyyy-mm-dd")
-    parser.add_argument("cloud", type=int, help="cloud coverage")
-    parser.add_argument("orderOrsearch", type=str, help="type 'order' for order and 'search'"
-                                                        "for print search results or 'update' to update the database with existing data")
-    parser.add_argument('-s', '--sat', nargs='?', type=int, default=8,
-                        help='which landsat to search or download, i.e. Landsat 8 = 8')
-    parser.add_argument('-f', '--find', nargs='*', type=str, default=None,
-                        help='top directory to search for local files to be added to the main cache')
-    args = parser.parse_args()
+    def log_message(self, format, *args):
+        logging.debug(format, *args)
 
-    loc = [args.lat, args.lon]
-    start_date = args.start_date
-    end_date = args.end_date
-    cloud = args.cloud
-    orderOrsearch = args.orderOrsearch
-    sat = args.sat
-    cacheDir = os.path.abspath(os.path.join(os.getcwd(), "SATELLITE_DATA", "LANDSAT"))
-    if not os.path.exists(cacheDir):
-        os.makedirs(cacheDir)
 
-    # =====USGS credentials===============
+def service_request(cacheDir, endpoint, params, timeout=SERVICE_TIMEOUT):
+    """
+    Sends a query to the catalog service running on a cache directory.
+
+    :param cacheDir:    directory of the Landsat cache
+    :param endpoint:    'search', 'available' or 'status'
+    :param params:      dict of query parameters, lists for repeated parameters
+    :param timeout:     seconds to wait for the answer
+    :return: the decoded JSON answer, or None when no service is running
+    """
+    path = os.path.join(cacheDir, SERVICE_FILE)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path) as f:
+            address = json.load(f)
+        url = "http://{0}:{1}/{2}?{3}".format(address['host'], address['port'], endpoint,
+                                             urlencode(params, doseq=True))
+        with urlopen(url, timeout=timeout) as response:
+            return json.loads(response.read().decode('utf-8'))
+    except (OSError, ValueError, KeyError):
+        # stale discovery file or the service is gone, answer directly
+        return None
+
+
+def _cursor_rows(cur):
+    """ the result of a query as a dict of columns and data rows, the JSON the service answers """
+    return dict(columns=[description[0] for description in cur.description], data=cur.fetchall())
+
+
+def _search_rows(lat, lon, start_date, end_date, cloud, available, cacheDir, sat, refresh=False):
+    """
+    search() as a dict of columns and data rows, answered by the catalog service when
+    one is running. Needs neither pandas nor numpy, which keeps the startup of the CLI
+    search short. The metadata is only checked against USGS with refresh=True, otherwise
+    the search stays offline and never imports requests.
+    """
+    answer = service_request(cacheDir, 'search', dict(lat=lat, lon=lon, start_date=start_date,
+                                                      end_date=end_date, cloud=cloud, available=available,
+                                                      sat=sat))
+    if answer is not None and 'error' not in answer:
+        return answer
+    end = datetime.strptime(end_date, '%Y-%m-%d') if refresh else None
+    db_name = _get_catalog(sat, cacheDir, end)
+    conn = _connect(db_name)
+    try:
+        return _cursor_rows(conn.execute(*_search_query(lat, lon, start_date, end_date, cloud, available, sat)))
+    finally:
+        conn.close()
+
+
+def search_service(lat, lon, start_date, end_date, cloud, available, cacheDir, sat):
+    """ search() answered by the catalog service when one is running, directly otherwise """
+    rows = _search_rows(lat, lon, start_date, end_date, cloud, available, cacheDir, sat, refresh=True)
+    return pd.DataFrame(rows['data'], columns=rows['columns'])
+
+
+# seconds a CLI search may take from the start of the module import to its answer
+SEARCH_STARTUP_TARGET = 0.25
+CLI_COMMANDS = ('search', 'update', 'order')
+
+
+def _usgs_credentials():
+    """ asks for the USGS username, the password is kept in the system keyring """
     # need to get this from pop up
     usgs_user = str(getpass.getpass(prompt="usgs username:"))
     if keyring.get_password("usgs", usgs_user) is None:
@@ -593,105 +2819,209 @@ def main():
         keyring.set_password("usgs", usgs_user, usgs_pass)
     else:
         usgs_pass = str(keyring.get_password("usgs", usgs_user))
+    return usgs_user, usgs_pass
 
-        # ======search for landsat data not on system===============================
-    if orderOrsearch == 'search':
-        available = 'N'
-        notDownloaded_df = search(loc[0], loc[1], start_date, end_date, cloud, available, cacheDir, sat)
-        available = 'Y'
-        Downloaded_df = search(loc[0], loc[1], start_date, end_date, cloud, available, cacheDir, sat)
-        print("====data needed to be downloaded==============================")
-        print(notDownloaded_df.LANDSAT_PRODUCT_ID.values)
-        print("====data available on system==================================")
-        print(Downloaded_df.LANDSAT_PRODUCT_ID.values)
-        print(Downloaded_df.local_file_path)
-
-    elif orderOrsearch == 'update':
-        findDir = args.find
-        findDir = findDir[0]
-
-        # ====find all landsat files on system==================================
-        fns = []
-        paths = []
-        for root, dirs, files in os.walk(findDir):
-            for file in files:
-                if (file.startswith("LC08")) and (file.endswith("MTL.txt")):
-                    fns.append(os.path.join(root, file))
-                    paths.append(root)
-        i = 0
-        productIDs = []
-        for fn in fns:
-            print(fn)
-            path = paths[i]
-            print(path)
-            i += 1
-            productIDs.append('_'.join(fn.split(os.sep)[-1].split('_')[:7]))
-        #        productIDs = np.unique(productIDs)
-        #        paths = np.unique(paths)
-        # =========copy all landsat files to the cache and put cache location in the database
-        orig_df = pd.DataFrame()
-        folders = []
-        for productID in productIDs:
-            print(productID)
-            scene = productID.split(os.sep)[-1].split('_')[2]
-            folder = os.path.join(cacheDir, "L%d" % sat, scene, "RAW_DATA")
-            if not os.path.exists(folder):
-                os.makedirs(folder)
-            folders.append(folder)
-            orig_df = orig_df.append(searchProduct(productID, cacheDir, sat), ignore_index=True)
-        updateDB(orig_df, folders, cacheDir, sat)
-        for productID in productIDs:
-            for path in paths:
-                fns = glob.glob(os.path.join(path, "*%s*" % productID))
-                scene = productID.split(os.sep)[-1].split('_')[2]
-                folder = os.path.join(cacheDir, "L%d" % sat, scene, "RAW_DATA")
-                if len(fns) > 0:
-                    for filename in fns:
-                        fn = filename.split(os.sep)[-1]
-                        outfn = os.path.join(folder, fn)
-                        if not os.path.exists(outfn):
-                            print("copying: %s " % productID)
-                            shutil.copy(filename, folder)
-                    continue
 
-    else:
-        available = 'N'
-        output_df = search(loc[0], loc[1], start_date, end_date, cloud, available, cacheDir, sat)
+def _command_argv(argv):
+    """
+    Maps the original `lat lon start_date end_date cloud search|update|order [options]`
+    command line onto the subcommands, so existing scripts keep working.
+    """
+    if not argv or argv[0] in CLI_COMMANDS:
+        return argv
+    for i, arg in enumerate(argv):
+        if arg in CLI_COMMANDS:
+            return [arg] + argv[:i] + argv[i + 1:]
+    return argv
+
+
+def _cli_search(args, cacheDir):
+    notDownloaded = _search_rows(args.lat, args.lon, args.start_date, args.end_date, args.cloud, 'N',
+                                 cacheDir, args.sat, refresh=args.refresh)
+    Downloaded = _search_rows(args.lat, args.lon, args.start_date, args.end_date, args.cloud, 'Y',
+                              cacheDir, args.sat)
+    productID = notDownloaded['columns'].index('LANDSAT_PRODUCT_ID')
+    local_file_path = Downloaded['columns'].index('local_file_path')
+    print("====data needed to be downloaded==============================")
+    print([row[productID] for row in notDownloaded['data']])
+    print("====data available on system==================================")
+    for row in Downloaded['data']:
+        print(row[productID], row[local_file_path])
+    # the products handed out are the ones evict_cache() should keep longest
+    touch_scenes(_metadata_paths(args.sat, cacheDir)[2], [row[productID] for row in Downloaded['data']])
+
+
+def _cli_update(args, cacheDir):
+    sat = args.sat
+    findDir = args.find
+    findDir = findDir[0]
+
+    # ====index all landsat files on system, one walk, grouped by product=====
+    db_name = _get_catalog(sat, cacheDir)
+    index = LocalSceneIndex(db_name)
+    index.update(findDir)
+    products = index.products(findDir, prefix=PRODUCT_PREFIXES.get(sat))
+    # =========link all landsat files into the cache and put cache location in the database
+    found_df = searchProducts(list(products), cacheDir, sat)
+    found = dict((productID, products[productID]) for productID in found_df.LANDSAT_PRODUCT_ID)
+    folders = ingest_products(found, cacheDir, sat, mode='link')
+    register_scenes(db_name, list(folders), list(folders.values()))
+
+
+def _cli_order(args, cacheDir):
+    sat = args.sat
+    start_date = args.start_date
+    # =====USGS credentials===============
+    usgs_user, usgs_pass = _usgs_credentials()
+
+    available = 'N'
+    output_df = search(args.lat, args.lon, start_date, args.end_date, args.cloud, available, cacheDir, sat)
+    if args.best is not None:
+        nscenes = len(output_df)
+        output_df = select_best_scenes(output_df, k=args.best, window=args.window, by=args.rank,
+                                       start_date=start_date).reset_index(drop=True)
+        print("Selected %d of %d scenes" % (len(output_df), nscenes))
+
+    productIDs = output_df.LANDSAT_PRODUCT_ID
+    cached = _search_rows(args.lat, args.lon, start_date, args.end_date, args.cloud, 'Y', cacheDir, sat)
+    productID = cached['columns'].index('LANDSAT_PRODUCT_ID')
+    cachedIDs = [row[productID] for row in cached['data']]
+    # the cached products of the query are used along with the new ones, mark them and
+    # keep them while making room for the products before downloading them
+    db_name = _get_catalog(sat, cacheDir)
+    touch_scenes(db_name, cachedIDs)
+    reserve_cache(db_name, len(productIDs), quota=args.quota, keep=cachedIDs)
+
+    download_folder = os.path.join(os.getcwd(), 'espa_downloads')
+    try:
+        # start Landsat order process
+        get_landsat_data(productIDs, ("%s" % usgs_user, "%s" % usgs_pass), cacheDir=cacheDir,
+                         pipeline=args.pipeline, include=args.include, exclude=args.exclude)
+    finally:
+        # ========move surface relectance files=====================================
+        # the products that did download are cached even when others failed
+        downloaded = group_product_files(download_folder)
+        wanted = dict((productID, downloaded[productID]) for productID in productIDs if productID in downloaded)
+        folders = ingest_products(wanted, cacheDir, sat, mode='move')
+        register_scenes(db_name, list(folders), list(folders.values()))
 
-        sceneIDs = output_df.sceneID
-        productIDs = output_df.LANDSAT_PRODUCT_ID
+    if os.path.exists(download_folder):
+        # ======Clean up folder, kept after a failure for the .part files to resume===
+        shutil.rmtree(download_folder)
 
-        # start Landsat order process
-        get_landsat_data(productIDs, ("%s" % usgs_user, "%s" % usgs_pass))
+    print("All done downloading data!!")
 
-        # ========move surface relectance files=====================================
-        download_folder = os.path.join(os.getcwd(), 'espa_downloads')
-        folders_2move = glob.glob(os.path.join(download_folder, '*'))
-        i = 0
-        paths = []
-        for sceneID in sceneIDs:
-            inputFolder = folders_2move[i]
-            i += 1
-            scene = sceneID[3:9]
-            folder = os.path.join(cacheDir, "L%d" % sat, scene, "RAW_DATA")
-            if not os.path.exists(folder):
-                os.makedirs(folder)
 
-            for filename in glob.glob(os.path.join(inputFolder, '*.*')):
-                shutil.copy(filename, folder)
-            paths.append(folder)
+def main(argv=None):
+    # Get time and location from user
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('-s', '--sat', nargs='?', type=int, default=8,
+                        help='which landsat to search or download, i.e. Landsat 8 = 8')
+    common.add_argument('-t', '--timing', action='store_true',
+                        help='report the time from the module import to the answer against '
+                             'SEARCH_STARTUP_TARGET')
+    query = argparse.ArgumentParser(add_help=False)
+    query.add_argument("lat", type=float, help="latitude")
+    query.add_argument("lon", type=float, help="longitude")
+    query.add_argument("start_date", type=str, help="Start date yyyy-mm-dd")
+    query.add_argument("end_date", type=str, help="End date yyyy-mm-dd")
+    query.add_argument("cloud", type=int, help="cloud coverage")
+
+    parser = argparse.ArgumentParser(description="search, order and keep a local cache of Landsat data")
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+    search_cmd = commands.add_parser('search', parents=[query, common], help='print the search results, offline')
+    search_cmd.add_argument('--refresh', action='store_true',
+                            help='check USGS for newer bulk metadata first, needs the network')
+    update = commands.add_parser('update', parents=[common],
+                                 help='update the database with existing data, offline')
+    update.add_argument('-f', '--find', nargs='*', type=str, default=None, required=True,
+                        help='top directory to search for local files to be added to the main cache')
+    # location and dates of the original command line, not used to update
+    update.add_argument('query', nargs='*', help=argparse.SUPPRESS)
+    order = commands.add_parser('order', parents=[query, common], help='order and download the scenes from ESPA')
+    order.add_argument('-i', '--include', nargs='*', type=str, default=None,
+                       help="only extract the downloaded files matching these patterns, "
+                            "e.g. '*_sr_band[2-5].tif' '*_bt_band10.tif' '*MTL.txt'")
+    order.add_argument('-x', '--exclude', nargs='*', type=str, default=None,
+                       help='skip the downloaded files matching these patterns')
+    order.add_argument('-k', '--best', type=int, default=None,
+                       help='only order the best k scenes per path/row per time window')
+    order.add_argument('-w', '--window', type=int, default=16,
+                       help='length in days of the time windows used with --best')
+    order.add_argument('-r', '--rank', type=str, default='cloud', choices=['cloud', 'date'],
+                       help='rank the scenes of a window by cloud cover or by date for --best')
+    order.add_argument('-p', '--pipeline', action='store_true',
+                       help='extract the downloaded archives in a process pool while the next downloads run')
+    order.add_argument('-q', '--quota', type=str, default=CACHE_QUOTA,
+                       help="byte quota of the local product cache, e.g. '500G', least recently used "
+                            "products are evicted before ordering more")
+    args = parser.parse_args(_command_argv(sys.argv[1:] if argv is None else list(argv)))
+
+    cacheDir = os.path.abspath(os.path.join(os.getcwd(), "SATELLITE_DATA", "LANDSAT"))
+    if not os.path.exists(cacheDir):
+        os.makedirs(cacheDir)
+
+    if args.command == 'search':
+        _cli_search(args, cacheDir)
+    elif args.command == 'update':
+        _cli_update(args, cacheDir)
+    else:
+        _cli_order(args, cacheDir)
+
+    if args.timing:
+        elapsed_time = time() - _IMPORT_START
+        print("%s took %.3fs from the module import (target %.3fs)" % (args.command, elapsed_time,
+                                                                         SEARCH_STARTUP_TARGET))
+        if args.command == 'search' and elapsed_time > SEARCH_STARTUP_TARGET:
+            heavy = [name for name in ('pandas', 'numpy', 'requests', 'keyring') if name in sys.modules]
+            logging.warning("search missed its startup target, modules imported: %s", ", ".join(heavy) or "none")
+
 
-        updateDB(output_df, paths, cacheDir, sat)
+def main_sites():
+    # Search the catalog for a file of sites in one go
+    parser = argparse.ArgumentParser(description="search the Landsat catalog for many sites at once")
+    parser.add_argument("sites", type=str, help="CSV file with site, lat and lon columns")
+    parser.add_argument("start_date", type=str, help="Start date yyyy-mm-dd")
+    parser.add_argument("end_date", type=str, help="End date yyyy-mm-dd")
+    parser.add_argument("cloud", type=int, help="cloud coverage")
+    parser.add_argument('-s', '--sat', nargs='?', type=int, default=8,
+                        help='which landsat to search or download, i.e. Landsat 8 = 8')
+    parser.add_argument('-o', '--output', type=str, default=None,
+                        help='CSV file to write the (site, scene) matches to, printed if omitted')
+    args = parser.parse_args()
+
+    cacheDir = os.path.abspath(os.path.join(os.getcwd(), "SATELLITE_DATA", "LANDSAT"))
+    if not os.path.exists(cacheDir):
+        os.makedirs(cacheDir)
 
-        if len(folders_2move) > 0:
-            # ======Clean up folder===============================
-            shutil.rmtree(download_folder)
+    output_df = search_sites(args.sites, args.start_date, args.end_date, args.cloud, cacheDir, args.sat)
+    if args.output:
+        output_df.to_csv(args.output, index=False)
+    else:
+        print(output_df.to_string(index=False))
+    print("====%d sites, %d scenes, %d needed to be downloaded====" % (
+        output_df.site.nunique(), output_df.LANDSAT_PRODUCT_ID.nunique(),
+        output_df.LANDSAT_PRODUCT_ID[output_df.available == 'N'].nunique()))
+
+
+def main_serve():
+    # Keep the catalog loaded and answer the CLI searches from memory
+    parser = argparse.ArgumentParser(description="serve Landsat catalog queries on localhost")
+    parser.add_argument('-p', '--port', type=int, default=0, help='port to listen on, a free one by default')
+    parser.add_argument('-c', '--cache-size', type=int, default=SERVICE_CACHE_SIZE,
+                        help='number of query results kept in memory')
+    args = parser.parse_args()
 
-        print("All done downloading data!!")
+    cacheDir = os.path.abspath(os.path.join(os.getcwd(), "SATELLITE_DATA", "LANDSAT"))
+    if not os.path.exists(cacheDir):
+        os.makedirs(cacheDir)
+    service = CatalogService(cacheDir, port=args.port, cache_size=args.cache_size)
+    service.serve_forever()
 
 
 if __name__ == "__main__":
     try:
         main()
-    except (KeyboardInterrupt, pycurl.error):
+    except KeyboardInterrupt:
         exit('Received Ctrl + C... Exiting! Bye.', 1)
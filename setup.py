@@ -10,7 +10,9 @@ base = os.getcwd()
     
 try:
     from setuptools import setup
-    setup_kwargs = {'entry_points': {'console_scripts':['getlandsatdata=getlandsatdata.getlandsatdata:main']}}
+    setup_kwargs = {'entry_points': {'console_scripts':['getlandsatdata=getlandsatdata.getlandsatdata:main',
+                                                        'getlandsatdata-sites=getlandsatdata.getlandsatdata:main_sites',
+                                                        'getlandsatdata-serve=getlandsatdata.getlandsatdata:main_serve']}}
 except ImportError:
     from distutils.core import setup
     setup_kwargs = {'scripts': ['bin/getlandsatdata']}
@@ -31,14 +33,15 @@ setup(
     py_modules=['getlandsatdata.getlandsatdata'],
     platforms='Posix; MacOS X; Windows',
     license='BSD 3-Clause',
+    python_requires='>=3.7',
     classifiers=[
         'Development Status :: 2 - Pre-Alpha',
         'Intended Audience :: Developers',
         'Intended Audience :: Science/Research',
         'License :: OSI Approved :: MIT License',
-        'Programming Language :: Python :: 2',
-        # Uses dictionary comprehensions ==> 2.7 only
-        'Programming Language :: Python :: 2.7',
+        'Programming Language :: Python :: 3',
+        # Uses asyncio.run ==> 3.7+
+        'Programming Language :: Python :: 3.7',
         'Topic :: Scientific/Engineering :: GIS',
     ],  
     **setup_kwargs
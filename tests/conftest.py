@@ -0,0 +1,84 @@
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from getlandsatdata import getlandsatdata
+from getlandsatdata.getlandsatdata import CATALOG_COLUMNS, build_catalog
+
+PRODUCT_ID = 'LC08_L1TP_030032_20170609_20170616_01_T1'
+
+
+class _FileHandler(BaseHTTPRequestHandler):
+    """ serves the files of server.root with an ETag, honouring If-None-Match and Range """
+
+    def do_GET(self):
+        server = self.server
+        server.requests.append(dict(path=self.path, headers=dict(self.headers)))
+        fn = os.path.join(server.root, self.path.lstrip('/'))
+        if not os.path.isfile(fn):
+            self.send_error(404)
+            return
+        with open(fn, 'rb') as f:
+            data = f.read()
+        etag = '"{0}"'.format(int(os.path.getmtime(fn) * 1e6))
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+        rng = self.headers.get('Range')
+        if rng:
+            start = int(rng.split('=')[1].split('-')[0])
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes {0}-{1}/{2}'.format(start, len(data) - 1, len(data)))
+            data = data[start:]
+        else:
+            self.send_response(200)
+        self.send_header('ETag', etag)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def no_backoff(monkeypatch):
+    """ retries without waiting """
+    monkeypatch.setattr(getlandsatdata, 'sleep', lambda seconds: None)
+
+
+@pytest.fixture
+def file_server(tmp_path):
+    """ local HTTP stand-in for the USGS/ESPA hosts, serving the files of tmp_path/'www' """
+    root = tmp_path / 'www'
+    root.mkdir()
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _FileHandler)
+    server.root = str(root)
+    server.requests = []
+    server.url = 'http://127.0.0.1:{0}/'.format(server.server_address[1])
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def landsat_catalog(tmp_path):
+    """ a one scene Landsat 8 catalog in the cache the CLI uses when run from tmp_path, returns the CSV path """
+    cacheDir = tmp_path / 'SATELLITE_DATA' / 'LANDSAT'
+    cacheDir.mkdir(parents=True)
+    row = dict(sceneID='LC80300322017160LGN00', sensor='OLI_TIRS', acquisitionDate='2017-06-09',
+               dateUpdated='2017-06-20', upperLeftCornerLatitude=41.0, upperLeftCornerLongitude=-101.0,
+               lowerRightCornerLatitude=39.0, lowerRightCornerLongitude=-99.0, cloudCover=10.0,
+               LANDSAT_PRODUCT_ID=PRODUCT_ID)
+    csv_fn = str(cacheDir / 'LANDSAT_8_C1.csv')
+    with open(csv_fn, 'w') as f:
+        f.write(','.join(CATALOG_COLUMNS) + '\n')
+        f.write(','.join(str(row[column]) for column in CATALOG_COLUMNS) + '\n')
+    build_catalog(csv_fn, str(cacheDir / 'LANDSAT_8_C1.db'))
+    return csv_fn
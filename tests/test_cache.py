@@ -0,0 +1,32 @@
+import os
+import sqlite3
+
+from conftest import PRODUCT_ID
+from getlandsatdata.getlandsatdata import evict_cache, register_scenes
+
+LINKED_ID = 'LC08_L1TP_030032_20170625_20170705_01_T1'
+
+
+def test_hardlinked_products_are_not_charged_or_evicted(tmp_path, landsat_catalog):
+    db_name = landsat_catalog[:-4] + '.db'
+    conn = sqlite3.connect(db_name)
+    conn.execute("INSERT INTO raw_data (sceneID, LANDSAT_PRODUCT_ID) VALUES ('LC80300322017176LGN00', ?)",
+                 (LINKED_ID,))
+    conn.commit()
+    folder = tmp_path / 'RAW_DATA'
+    folder.mkdir()
+    (folder / (PRODUCT_ID + '_sr_band1.tif')).write_bytes(b'0' * 100)
+    # update links the user's own files into the cache
+    original = tmp_path / (LINKED_ID + '_sr_band1.tif')
+    original.write_bytes(b'0' * 1000)
+    os.link(str(original), str(folder / original.name))
+    register_scenes(db_name, [LINKED_ID, PRODUCT_ID], [str(folder), str(folder)])
+
+    assert dict(conn.execute("SELECT LANDSAT_PRODUCT_ID, cache_bytes FROM raw_data")) == {PRODUCT_ID: 100,
+                                                                                        LINKED_ID: 0}
+
+    assert evict_cache(db_name, quota=0) == 100
+    rows = dict(conn.execute("SELECT LANDSAT_PRODUCT_ID, local_file_path FROM raw_data"))
+    conn.close()
+    assert rows == {PRODUCT_ID: '', LINKED_ID: str(folder)}
+    assert os.listdir(str(folder)) == [original.name]
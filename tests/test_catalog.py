@@ -0,0 +1,44 @@
+import sqlite3
+import types
+
+import pandas
+
+from getlandsatdata import getlandsatdata
+from getlandsatdata.getlandsatdata import CATALOG_COLUMNS, refresh_catalog
+
+
+def _append_scene(csv_fn, sceneID, productID, dateUpdated):
+    row = dict(sceneID=sceneID, sensor='OLI_TIRS', acquisitionDate='2017-06-25', dateUpdated=dateUpdated,
+               upperLeftCornerLatitude=41.0, upperLeftCornerLongitude=-101.0, lowerRightCornerLatitude=39.0,
+               lowerRightCornerLongitude=-99.0, cloudCover=5.0, LANDSAT_PRODUCT_ID=productID)
+    with open(csv_fn, 'a') as f:
+        f.write(','.join(str(row[column]) for column in CATALOG_COLUMNS) + '\n')
+
+
+def test_refresh_scans_the_csv_without_the_write_lock(landsat_catalog, monkeypatch):
+    db_name = landsat_catalog[:-4] + '.db'
+    _append_scene(landsat_catalog, 'LC80300322017176LGN00', 'LC08_L1TP_030032_20170625_20170705_01_T1', '2017-07-05')
+    _append_scene(landsat_catalog, 'LC80300322017192LGN00', 'LC08_L1TP_030032_20170711_20170721_01_T1', '2017-07-21')
+    writes = []
+
+    def read_csv(*args, **kwargs):
+        for chunk in pandas.read_csv(*args, **kwargs):
+            # another process registering a scene must not wait for the scan
+            other = sqlite3.connect(db_name, timeout=0)
+            other.execute("BEGIN IMMEDIATE")
+            other.execute("UPDATE raw_data SET sr = 'Y' WHERE sceneID = 'LC80300322017160LGN00'")
+            other.commit()
+            other.close()
+            writes.append(len(chunk))
+            yield chunk
+
+    monkeypatch.setattr(getlandsatdata, 'pd', types.SimpleNamespace(read_csv=read_csv))
+
+    assert refresh_catalog(landsat_catalog, db_name, chunksize=1) == 3
+    assert len(writes) == 3
+    conn = sqlite3.connect(db_name)
+    rows = dict(conn.execute("SELECT sceneID, sr FROM raw_data"))
+    nrtree = conn.execute("SELECT COUNT(*) FROM raw_data_rtree").fetchone()[0]
+    conn.close()
+    assert rows == {'LC80300322017160LGN00': 'Y', 'LC80300322017176LGN00': 'N', 'LC80300322017192LGN00': 'N'}
+    assert nrtree == 3
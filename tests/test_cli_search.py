@@ -0,0 +1,71 @@
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+from time import time
+
+from conftest import PRODUCT_ID
+from getlandsatdata.getlandsatdata import SEARCH_STARTUP_TARGET, register_scenes
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SEARCH = """
+import sys
+from getlandsatdata import getlandsatdata
+getlandsatdata.main(['search', '40.0', '-100.0', '2017-06-01', '2017-07-01', '50'])
+print(sorted(name for name in ('pandas', 'numpy', 'requests', 'keyring') if name in sys.modules))
+"""
+
+
+def _search(tmp_path):
+    env = dict(os.environ, PYTHONPATH=REPO)
+    out = subprocess.run([sys.executable, '-c', SEARCH], cwd=str(tmp_path), env=env,
+                         stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True, check=True)
+    return out.stdout.strip().splitlines()
+
+
+def test_search_keeps_heavy_imports_off_the_startup_path(tmp_path, landsat_catalog):
+    lines = _search(tmp_path)
+
+    assert "['%s']" % PRODUCT_ID in lines
+    assert lines[-1] == '[]'
+
+
+def test_search_cold_start_stays_near_its_target(tmp_path, landsat_catalog):
+    # the whole process, interpreter startup included, with slack for slow machines
+    elapsed = []
+    for _ in range(3):
+        start = time()
+        _search(tmp_path)
+        elapsed.append(time() - start)
+
+    assert min(elapsed) < 4 * SEARCH_STARTUP_TARGET
+
+
+def test_search_stays_offline_with_stale_metadata(tmp_path, landsat_catalog):
+    # last checked long before the end date of the search, a refresh would go to USGS
+    with open(landsat_catalog + '.json', 'w') as f:
+        json.dump(dict(etag='"v1"', checked='2017-01-01T00:00:00'), f)
+
+    lines = _search(tmp_path)
+
+    assert "['%s']" % PRODUCT_ID in lines
+    assert lines[-1] == '[]'
+
+
+def test_search_marks_the_cached_products_used(tmp_path, landsat_catalog):
+    db_name = landsat_catalog[:-4] + '.db'
+    folder = tmp_path / 'RAW_DATA'
+    folder.mkdir()
+    (folder / (PRODUCT_ID + '_sr_band1.tif')).write_bytes(b'0' * 10)
+    register_scenes(db_name, [PRODUCT_ID], [str(folder)])
+    conn = sqlite3.connect(db_name)
+    conn.execute("UPDATE raw_data SET last_access = 0")
+    conn.commit()
+
+    lines = _search(tmp_path)
+
+    assert lines[-1] == '[]'
+    assert conn.execute("SELECT last_access FROM raw_data").fetchone()[0] > 0
+    conn.close()
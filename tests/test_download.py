@@ -0,0 +1,107 @@
+import os
+import tarfile
+
+import pytest
+
+from getlandsatdata import getlandsatdata
+from getlandsatdata.getlandsatdata import BaseDownloader
+
+pytestmark = pytest.mark.usefixtures('no_backoff')
+
+
+def _archive(tmp_path, name):
+    member = tmp_path / (name + '_sr_band1.tif')
+    member.write_bytes(b'0' * 100)
+    with tarfile.open(str(tmp_path / 'www' / (name + '.tar.gz')), 'w:gz') as tar:
+        tar.add(str(member), arcname=member.name)
+
+
+def test_download_queue_finishes_the_others_before_raising(file_server, tmp_path):
+    downloader = BaseDownloader(str(tmp_path / 'dl'))
+    _archive(tmp_path, 'good')
+    downloader.enqueue(file_server.url + 'good.tar.gz')
+    downloader.enqueue(file_server.url + 'missing.tar.gz')
+
+    results = []
+    with pytest.raises(Exception, match='1 of 2 downloads failed'):
+        for result in downloader.download_queue():
+            results.append(result)
+
+    assert results == [(str(tmp_path / 'dl' / 'good'), True)]
+
+
+class _CompletePoller(object):
+    """ stands in for OrderPoller, every watched item is complete right away """
+
+    def __init__(self, auth, **kwargs):
+        self.items = []
+
+    def watch(self, orderid, names):
+        self.items.extend((orderid, name) for name in names)
+
+    async def run(self, on_complete):
+        for orderid, url in self.items:
+            on_complete(orderid, {'product_dload_url': url})
+
+
+@pytest.mark.parametrize('pipeline', [False, True])
+def test_download_orders_finishes_the_others_before_raising(file_server, tmp_path, monkeypatch, pipeline):
+    monkeypatch.setattr(getlandsatdata, 'OrderPoller', _CompletePoller)
+    _archive(tmp_path, 'good')
+    orders = {'order-1': [file_server.url + 'missing.tar.gz', file_server.url + 'good.tar.gz']}
+
+    results = []
+    with pytest.raises(Exception, match='1 of 2 downloads failed'):
+        for result in getlandsatdata.download_orders(orders, ('user', 'pass'),
+                                                     downloader=BaseDownloader(str(tmp_path / 'dl')),
+                                                     pipeline=pipeline):
+            results.append(result)
+
+    assert results == [(str(tmp_path / 'dl' / 'good'), True)]
+
+
+def _no_staging(downloader, monkeypatch):
+    def staged(*args, **kwargs):
+        raise AssertionError("the archive was staged on disk")
+
+    monkeypatch.setattr(downloader, '_download', staged)
+
+
+def test_pipeline_queue_streams_stream_items(file_server, tmp_path, monkeypatch):
+    downloader = BaseDownloader(str(tmp_path / 'dl'), extract_workers=1)
+    _no_staging(downloader, monkeypatch)
+    _archive(tmp_path, 'good')
+    downloader.enqueue(file_server.url + 'good.tar.gz', stream=True)
+
+    assert list(downloader.pipeline_queue()) == [(str(tmp_path / 'dl' / 'good'), True)]
+    assert os.listdir(str(tmp_path / 'dl' / 'good')) == ['good_sr_band1.tif']
+
+
+def test_download_orders_streams_in_pipeline_mode(file_server, tmp_path, monkeypatch):
+    monkeypatch.setattr(getlandsatdata, 'OrderPoller', _CompletePoller)
+    downloader = BaseDownloader(str(tmp_path / 'dl'), extract_workers=1)
+    _no_staging(downloader, monkeypatch)
+    _archive(tmp_path, 'good')
+    orders = {'order-1': [file_server.url + 'good.tar.gz']}
+
+    results = list(getlandsatdata.download_orders(orders, ('user', 'pass'), downloader=downloader,
+                                                  pipeline=True, stream=True))
+
+    assert results == [(str(tmp_path / 'dl' / 'good'), True)]
+
+
+def test_download_order_gen_backs_off_after_a_failed_check(file_server, tmp_path, monkeypatch):
+    _archive(tmp_path, 'good')
+    item = dict(name='good', status='complete', product_dload_url=file_server.url + 'good.tar.gz')
+    # connection, decode and HTTP failures come back from espa_api as None
+    responses = [None, None, {'order-1': [item]}]
+    monkeypatch.setattr(getlandsatdata, 'espa_api', lambda *args, **kwargs: responses.pop(0))
+    waits = []
+    monkeypatch.setattr(getlandsatdata, 'sleep', waits.append)
+
+    results = list(getlandsatdata.download_order_gen('order-1', ('user', 'pass'),
+                                                     downloader=BaseDownloader(str(tmp_path / 'dl')),
+                                                     sleep_time=10))
+
+    assert results == [(str(tmp_path / 'dl' / 'good'), True)]
+    assert waits == [20, 40]
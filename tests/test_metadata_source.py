@@ -0,0 +1,50 @@
+import json
+import os
+from datetime import datetime
+
+from getlandsatdata import getlandsatdata
+from getlandsatdata.getlandsatdata import MetadataSource
+
+
+def test_refresh_stores_etag_then_skips_unchanged_file(file_server, tmp_path):
+    (tmp_path / 'www' / 'LANDSAT_8_C1.csv').write_text('sceneID\nLC80010012017001LGN00\n')
+    local_path = str(tmp_path / 'LANDSAT_8_C1.csv')
+    source = MetadataSource(file_server.url + 'LANDSAT_8_C1.csv', local_path)
+
+    assert source.refresh() is True
+    with open(local_path + '.json') as f:
+        state = json.load(f)
+    assert state['etag']
+    assert open(local_path).read().startswith('sceneID')
+    mtime = os.path.getmtime(local_path)
+
+    assert source.refresh() is False
+    assert file_server.requests[-1]['headers'].get('If-None-Match') == state['etag']
+    assert os.path.getmtime(local_path) == mtime
+    assert not os.path.exists(local_path + '.part')
+
+
+def test_refresh_downloads_again_once_the_local_copy_is_gone(file_server, tmp_path):
+    (tmp_path / 'www' / 'LANDSAT_8_C1.csv').write_text('sceneID\n')
+    local_path = str(tmp_path / 'LANDSAT_8_C1.csv')
+    source = MetadataSource(file_server.url + 'LANDSAT_8_C1.csv', local_path)
+    assert source.refresh() is True
+
+    os.remove(local_path)
+    assert source.refresh() is True
+    assert 'If-None-Match' not in file_server.requests[-1]['headers']
+    assert os.path.exists(local_path)
+
+
+def test_catalog_survives_a_failed_refresh(file_server, tmp_path, landsat_catalog, monkeypatch):
+    # the metadata file is missing on the server, the conditional check fails with a 404
+    monkeypatch.setattr(getlandsatdata, 'metadata_host', file_server.url)
+    with open(landsat_catalog + '.json', 'w') as f:
+        json.dump(dict(etag='"v1"', checked='2017-01-01T00:00:00'), f)
+    cacheDir = os.path.dirname(landsat_catalog)
+
+    db_name = getlandsatdata._get_catalog(8, cacheDir, datetime(2017, 7, 1))
+
+    assert file_server.requests
+    assert os.path.exists(db_name)
+    assert getlandsatdata.search(40.0, -100.0, '2017-06-01', '2017-07-01', 50, 'N', cacheDir, 8).shape[0] == 1
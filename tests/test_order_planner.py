@@ -0,0 +1,76 @@
+from time import time
+
+import pytest
+
+from getlandsatdata.getlandsatdata import OrderPlanner
+
+SCENE = 'LC08_L1TP_030032_20170609_20170616_01_T1'
+
+
+@pytest.fixture
+def planner(tmp_path):
+    planner = OrderPlanner(('user', 'pass'), cache_db=str(tmp_path / 'espa_orders.db'), claim_timeout=3600)
+    yield planner
+    planner.close()
+
+
+def _inflight(planner, productID, orderid, age):
+    planner.conn.execute("INSERT OR REPLACE INTO inflight VALUES (?, ?, ?)", (productID, orderid, time() - age))
+
+
+def _row(planner, productID):
+    return planner.conn.execute("SELECT orderid FROM inflight WHERE productID = ?", (productID,)).fetchone()
+
+
+def test_recent_unlisted_order_is_reused(planner):
+    # placed by another run moments ago, ESPA does not list it yet
+    _inflight(planner, SCENE, 'order-a', age=60)
+
+    assert planner.claim([SCENE], listed_items={}) == ({'order-a': {SCENE}}, [])
+
+
+def test_listed_order_in_progress_is_reused(planner):
+    _inflight(planner, SCENE, 'order-a', age=2 * 3600)
+
+    assert planner.claim([SCENE], {('order-a', SCENE): 'processing'}) == ({'order-a': {SCENE}}, [])
+
+
+@pytest.mark.parametrize('status', ['error', 'unavailable', 'purged', 'cancelled'])
+def test_failed_or_purged_item_is_claimed_again(planner, status):
+    _inflight(planner, SCENE, 'order-a', age=60)
+
+    assert planner.claim([SCENE], {('order-a', SCENE): status}) == ({}, [SCENE])
+    assert _row(planner, SCENE) == (None,)
+
+
+def test_abandoned_claim_is_claimed_again(planner):
+    # claimed by a run that died before placing its order
+    _inflight(planner, SCENE, None, age=2 * 3600)
+
+    assert planner.claim([SCENE]) == ({}, [SCENE])
+
+
+def test_old_order_no_longer_listed_is_claimed_again(planner):
+    _inflight(planner, SCENE, 'order-a', age=2 * 3600)
+
+    assert planner.claim([SCENE], {('order-b', 'other'): 'complete'}) == ({}, [SCENE])
+    assert _row(planner, SCENE) == (None,)
+
+
+def test_failed_submit_releases_the_claim(planner, monkeypatch):
+    def fail(productIDs):
+        raise Exception("ESPA is down")
+
+    monkeypatch.setattr(planner, '_submit', fail)
+
+    assert planner.submit([SCENE]) == {}
+    assert _row(planner, SCENE) is None
+    # the next run orders the scene instead of waiting for the released claim
+    assert planner.claim([SCENE]) == ({}, [SCENE])
+
+
+def test_submitted_order_is_recorded(planner, monkeypatch):
+    monkeypatch.setattr(planner, '_submit', lambda productIDs: 'order-c')
+
+    assert planner.submit([SCENE]) == {'order-c': {SCENE}}
+    assert _row(planner, SCENE) == ('order-c',)
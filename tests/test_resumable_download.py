@@ -0,0 +1,48 @@
+import hashlib
+import os
+
+import pytest
+
+from getlandsatdata.getlandsatdata import BaseDownloader
+
+pytestmark = pytest.mark.usefixtures('no_backoff')
+
+
+@pytest.fixture
+def payload(tmp_path):
+    data = os.urandom(3 * 1024 + 17)
+    (tmp_path / 'www' / 'scene.tar.gz').write_bytes(data)
+    return data
+
+
+def test_download_resumes_from_part_file(file_server, tmp_path, payload):
+    downloader = BaseDownloader(str(tmp_path / 'dl'))
+    dest = str(tmp_path / 'scene.tar.gz')
+    with open(dest + '.part', 'wb') as f:
+        f.write(payload[:1000])
+
+    downloader._download(file_server.url + 'scene.tar.gz', dest, checksum=hashlib.md5(payload).hexdigest())
+
+    assert file_server.requests[-1]['headers'].get('Range') == 'bytes=1000-'
+    assert open(dest, 'rb').read() == payload
+    assert not os.path.exists(dest + '.part')
+
+
+def test_download_rejects_checksum_mismatch(file_server, tmp_path, payload):
+    downloader = BaseDownloader(str(tmp_path / 'dl'))
+    dest = str(tmp_path / 'scene.tar.gz')
+
+    with pytest.raises(IOError):
+        downloader._download(file_server.url + 'scene.tar.gz', dest, checksum='0' * 32)
+
+    assert not os.path.exists(dest)
+    assert not os.path.exists(dest + '.part')
+
+
+def test_download_gives_up_after_retries(file_server, tmp_path):
+    downloader = BaseDownloader(str(tmp_path / 'dl'))
+
+    with pytest.raises(IOError):
+        downloader._download(file_server.url + 'missing.tar.gz', str(tmp_path / 'missing.tar.gz'), retries=2)
+
+    assert len(file_server.requests) == 2
@@ -0,0 +1,35 @@
+import os
+
+import pytest
+
+from conftest import PRODUCT_ID
+from getlandsatdata.getlandsatdata import search, search_aoi, search_sites
+
+
+@pytest.fixture
+def cacheDir(landsat_catalog):
+    return os.path.dirname(landsat_catalog)
+
+
+@pytest.mark.parametrize('start_date, end_date, cloud, available, found', [
+    ('2017-06-01', '2017-07-01', 50, 'N', True),
+    ('2017-06-10', '2017-07-01', 50, 'N', False),
+    ('2017-06-01', '2017-06-09', 50, 'N', False),
+    ('2017-06-01', '2017-07-01', 5, 'N', False),
+    ('2017-06-01', '2017-07-01', 50, 'Y', False),
+])
+def test_point_area_and_site_searches_agree(cacheDir, start_date, end_date, cloud, available, found):
+    point = search(40.0, -100.0, start_date, end_date, cloud, available, cacheDir, 8)
+    area = search_aoi((-100.5, 39.5, -99.5, 40.5), start_date, end_date, cloud, available, cacheDir, 8)
+    sites = search_sites([('site', 40.0, -100.0)], start_date, end_date, cloud, cacheDir, 8, available=available)
+
+    expected = [PRODUCT_ID] if found else []
+    assert list(point.LANDSAT_PRODUCT_ID) == expected
+    assert list(area.LANDSAT_PRODUCT_ID) == expected
+    assert list(sites.LANDSAT_PRODUCT_ID) == expected
+
+
+def test_point_outside_the_scene_corners_is_not_found(cacheDir):
+    assert search(41.5, -100.0, '2017-06-01', '2017-07-01', 50, 'N', cacheDir, 8).empty
+    assert search_sites([('site', 41.5, -100.0)], '2017-06-01', '2017-07-01', 50, cacheDir, 8).empty
+    assert search_aoi((-100.5, 41.5, -99.5, 42.0), '2017-06-01', '2017-07-01', 50, None, cacheDir, 8).empty
@@ -0,0 +1,56 @@
+import json
+import os
+import threading
+import time
+
+import pytest
+
+from conftest import PRODUCT_ID
+from getlandsatdata import getlandsatdata
+from getlandsatdata.getlandsatdata import CatalogService, register_scenes, service_request
+
+
+@pytest.fixture
+def service(landsat_catalog, monkeypatch):
+    refreshed = []
+    monkeypatch.setattr(getlandsatdata.MetadataSource, 'refresh', lambda self, force=False: refreshed.append(1))
+    # checked long ago, any search would find the metadata stale
+    with open(landsat_catalog + '.json', 'w') as f:
+        json.dump(dict(etag='"v1"', checked='2017-01-01T00:00:00'), f)
+    service = CatalogService(os.path.dirname(landsat_catalog))
+    service.refreshed = refreshed
+    thread = threading.Thread(target=service.serve_forever, daemon=True)
+    thread.start()
+    while not os.path.exists(service.path):
+        time.sleep(0.01)
+    yield service
+    service.shutdown()
+    thread.join()
+
+
+def _search(service, available):
+    return service_request(service.cacheDir, 'search', dict(lat=40.0, lon=-100.0, start_date='2017-06-01',
+                                                            end_date='2017-07-01', cloud=50,
+                                                            available=available, sat=8))
+
+
+def test_queries_use_pooled_connections_and_never_refresh(service):
+    first = _search(service, 'N')
+    columns = first['columns']
+    assert [row[columns.index('LANDSAT_PRODUCT_ID')] for row in first['data']] == [PRODUCT_ID]
+    assert _search(service, 'N') == first
+    assert service_request(service.cacheDir, 'status', {})['hits'] == 1
+    assert service.refreshed == []
+    assert len(service.readers[8]) == 1
+
+    service.refresh()
+    assert service.refreshed == [1]
+
+
+def test_registered_scenes_are_seen_by_the_next_query(service, tmp_path):
+    assert _search(service, 'Y')['data'] == []
+    register_scenes(service.catalogs[8], [PRODUCT_ID], [str(tmp_path)])
+
+    assert len(_search(service, 'Y')['data']) == 1
+    available = service_request(service.cacheDir, 'available', dict(sat=8, productID=[PRODUCT_ID]))
+    assert available['data'] == [[PRODUCT_ID, 'Y', 'Y', str(tmp_path)]]
@@ -0,0 +1,52 @@
+import os
+import subprocess
+import sys
+
+from conftest import PRODUCT_ID
+from getlandsatdata.getlandsatdata import CatalogSnapshot, register_scenes
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+OPEN = """
+import sys
+from getlandsatdata.getlandsatdata import CatalogSnapshot
+print(CatalogSnapshot.open(sys.argv[1]).path)
+"""
+
+
+def _folders(db_name):
+    directory, base = os.path.split(db_name)
+    return sorted(name for name in os.listdir(directory)
+                  if name.startswith(base + '.snapshot') and os.path.isdir(os.path.join(directory, name)))
+
+
+def test_open_rebuilds_into_a_new_folder_once_the_catalog_changes(tmp_path, landsat_catalog):
+    db_name = landsat_catalog[:-4] + '.db'
+    first = CatalogSnapshot.open(db_name)
+    assert len(first) == 1 and not first['available'][0]
+    assert CatalogSnapshot.open(db_name).path == first.path
+
+    register_scenes(db_name, [PRODUCT_ID], [str(tmp_path)])
+    second = CatalogSnapshot.open(db_name)
+    assert second.path != first.path
+    assert second['available'][0]
+    # the previous folder stays for readers of the old pointer
+    assert _folders(db_name) == sorted(os.path.basename(p) for p in (first.path, second.path))
+
+    third = CatalogSnapshot.build(db_name)
+    assert _folders(db_name) == sorted(os.path.basename(p) for p in (second.path, third.path))
+
+
+def test_concurrent_opens_build_the_snapshot_once(landsat_catalog):
+    db_name = landsat_catalog[:-4] + '.db'
+    env = dict(os.environ, PYTHONPATH=REPO)
+    procs = [subprocess.Popen([sys.executable, '-c', OPEN, db_name], env=env, stdout=subprocess.PIPE,
+                              universal_newlines=True) for _ in range(4)]
+    paths = set()
+    for proc in procs:
+        out, _ = proc.communicate()
+        assert proc.returncode == 0
+        paths.add(out.strip().splitlines()[-1])
+
+    assert len(paths) == 1
+    assert len(_folders(db_name)) == 1